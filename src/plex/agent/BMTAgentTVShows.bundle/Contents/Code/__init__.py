@@ -27,6 +27,9 @@ myconfig = None
 mysagex  = None
 myplex   = None
 
+# [s] update() writes the SageX statistics at most this often
+STATS_INTERVAL = 600
+
 
 def Start():
     '''This function is called when the plug-in first starts. It can be
@@ -59,7 +62,18 @@ def Start():
     # create the SageX object from sagex module
     mysagex = sagex.SageX(sagexHost,
                           useLock=myconfig.getAgentLocking(),
-                          log=mylog)
+                          log=mylog,
+                          poolSize=myconfig.getSagexPoolSize(),
+                          poolTimeout=myconfig.getSagexPoolTimeout(),
+                          useIndex=myconfig.getSagexIndex(),
+                          indexTtl=myconfig.getSagexIndexTtl(),
+                          batchWindow=myconfig.getAgentBatchWindow(),
+                          apiLimit=myconfig.getAgentApiLimit(),
+                          fanartLimit=myconfig.getAgentFanartLimit(),
+                          seriesCacheSize=myconfig.getAgentSeriesCacheSize(),
+                          seriesCacheTtl=myconfig.getAgentSeriesCacheTtl(),
+                          profile=sagex.PROFILE_AGENT
+                          if myconfig.getSagexProfiles() else None)
     # create plex api object
     myplex = plexapi.PlexApi(plexHost, log=mylog,
                              token=myconfig.getPlexToken())
@@ -267,6 +281,8 @@ class BMTAgent(Agent.TV_Shows):
                              episode.originally_available_at, episode.duration,
                              episode.season, metadata.content_rating))
 
+        mysagex.logStats(STATS_INTERVAL)
+
 
     def setShowSeriesInfo(self, metadata, media, mf, mylog):
         '''Set information about the Show based on a Sage MediafileID
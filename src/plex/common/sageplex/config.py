@@ -29,6 +29,10 @@ CFG_FILE = 'sageplex_cfg.json'
 # default log file name
 LOG_FILE = 'sageplex_scanner.log'
 
+# default MediaFile cache file name
+CACHE_FILE = 'sageplex_cache.db'
+SYNC_STATE_FILE = 'sageplex_sync.db'
+
 # default PMS data location
 LOC_WIN = [ '%LOCALAPPDATA%\\Plex Media Server',
             '%USERPROFILE%\\Local Settings\\Application Data\\Plex Media Server' ]
@@ -56,6 +60,7 @@ class Config(object):
         @param log       PlexLog obj from agent, or None
         '''
         self.data = {}
+        self.cfgFile = None
         self.SAGEX_HOST = None
         self.PLEX_HOST = None
         if log:  # called from agent
@@ -86,6 +91,7 @@ class Config(object):
             return
         # now try to open the JSON file and read it
         self.log.info('Config: %s', cfg)
+        self.cfgFile = cfg
         try:
             if log: # if in agent, use readFile()
                 data_file = self.readFile(cfg)
@@ -168,6 +174,36 @@ class Config(object):
                                (user, password, host, port))
         return self.SAGEX_HOST
 
+    def getSagexPoolSize(self):
+        '''Return the max number of keep-alive sagex connections'''
+        sagex = self.data.get('sagex')
+        if sagex:
+            return sagex.get('pool_size')
+
+    def getSagexPoolTimeout(self):
+        '''Return the idle timeout [s] of keep-alive sagex connections'''
+        sagex = self.data.get('sagex')
+        if sagex:
+            return sagex.get('pool_timeout')
+
+    def getSagexIndex(self):
+        '''Return whether to use a local index of all media files'''
+        sagex = self.data.get('sagex')
+        if sagex:
+            return sagex.get('index')
+
+    def getSagexIndexTtl(self):
+        '''Return the time [s] the media file index is trusted'''
+        sagex = self.data.get('sagex')
+        if sagex:
+            return sagex.get('index_ttl')
+
+    def getSagexProfiles(self):
+        '''Return whether to fetch only the MediaFile fields used'''
+        sagex = self.data.get('sagex')
+        if sagex:
+            return sagex.get('profiles')
+
     def getPlexHost(self):
         '''Return a PLEX_HOST setting or None'''
         if self.PLEX_HOST: # if cached value exist, return it
@@ -203,18 +239,148 @@ class Config(object):
         if scanner:
             return scanner.get('debug')
 
+    def getScannerWarmUp(self):
+        '''Return whether the scanner warms up sagex when loaded'''
+        scanner = self.data.get('scanner')
+        if scanner:
+            return scanner.get('warm_up')
+
+    def getScannerSidecar(self):
+        '''Return whether the scanner reads .properties sidecars'''
+        scanner = self.data.get('scanner')
+        if scanner:
+            return scanner.get('sidecar')
+
     def getAgentLocking(self):
-        '''Return the agent locking setting'''
+        '''Return the agent locking setting
+
+        With locking, the agent makes one sagex call or fanart download
+        at a time, and the api/fanart limits are not used.
+        '''
         agent = self.data.get('agent')
         if agent:
             return agent.get('locking')
 
+    def getAgentApiLimit(self):
+        '''Return the max concurrent sagex api calls without locking'''
+        agent = self.data.get('agent')
+        if agent:
+            return agent.get('api_limit')
+
+    def getAgentFanartLimit(self):
+        '''Return the max concurrent fanart downloads without locking'''
+        agent = self.data.get('agent')
+        if agent:
+            return agent.get('fanart_limit')
+
+    def getAgentSeriesCacheSize(self):
+        '''Return the max number of series info cached by the agent'''
+        agent = self.data.get('agent')
+        if agent:
+            return agent.get('series_cache_size')
+
+    def getAgentSeriesCacheTtl(self):
+        '''Return the time [s] the agent caches series info'''
+        agent = self.data.get('agent')
+        if agent:
+            return agent.get('series_cache_ttl')
+
+    def getAgentBatchWindow(self):
+        '''Return the agent sagex lookup batching window [ms]'''
+        agent = self.data.get('agent')
+        if agent:
+            return agent.get('batch_window')
+
+    def getCacheFile(self):
+        '''Return the MediaFile cache location, or None if disabled
+
+        Defaults to sageplex_cache.db next to the configuration file,
+        so the scanner and sync tool share the same cache.
+        '''
+        cache = self.data.get('cache')
+        if not cache or not cache.get('enabled'):
+            return
+        f = cache.get('file')
+        if f:
+            if '~' in f:
+                return os.path.expanduser(f)
+            else:
+                return os.path.expandvars(f)
+        if self.cfgFile:
+            return os.path.join(os.path.dirname(self.cfgFile), CACHE_FILE)
+
+    def getCacheTtl(self):
+        '''Return the max age [s] of MediaFile cache entries'''
+        cache = self.data.get('cache')
+        if cache:
+            return cache.get('ttl')
+
+    def getCacheMaxEntries(self):
+        '''Return the max number of MediaFile cache entries'''
+        cache = self.data.get('cache')
+        if cache:
+            return cache.get('max_entries')
+
+    def getSyncStateFile(self):
+        '''Return the sync tool state database location
+
+        Defaults to sageplex_sync.db next to the configuration file.
+        '''
+        sync = self.data.get('sync')
+        f = sync.get('state_file') if sync else None
+        if f:
+            if '~' in f:
+                return os.path.expanduser(f)
+            else:
+                return os.path.expandvars(f)
+        if self.cfgFile:
+            return os.path.join(os.path.dirname(self.cfgFile), SYNC_STATE_FILE)
+
+    def getSyncReverify(self):
+        '''Return the max age [s] of an in-sync video before the sync
+        tool checks it with SageTV again'''
+        sync = self.data.get('sync')
+        if sync:
+            return sync.get('reverify')
+
+    def getSyncInterval(self):
+        '''Return the time [s] between syncs in daemon mode'''
+        sync = self.data.get('sync')
+        if sync:
+            return sync.get('interval')
+
+    def getSyncFastInterval(self):
+        '''Return the time [s] between syncs in daemon mode after a
+        sync that found changes'''
+        sync = self.data.get('sync')
+        if sync:
+            return sync.get('fast_interval')
+
+    def getSyncControlPort(self):
+        '''Return the localhost port of the sync daemon control
+        interface, 0 to disable'''
+        sync = self.data.get('sync')
+        if sync:
+            return sync.get('control_port')
+
     def getPlexToken(self):
         '''Returns the PLEX access token, if any'''
         plex = self.data.get('plex')
         if plex:
             return plex.get('token')
 
+    def getPlexPageSize(self):
+        '''Returns the number of items to fetch per PLEX request'''
+        plex = self.data.get('plex')
+        if plex:
+            return plex.get('page_size')
+
+    def getPlexWalkWorkers(self):
+        '''Returns the number of threads used to walk the PLEX tree'''
+        plex = self.data.get('plex')
+        if plex:
+            return plex.get('walk_workers')
+
 
 ######################################################################
 
@@ -222,11 +388,31 @@ class Config(object):
 def main():
     cfg = Config(sys.platform, 'SAGEPLEX_CFG')
     cfg.log.info('SAGEX_HOST: %s', cfg.getSagexHost())
+    cfg.log.info('sagex pool: %s [%ss]', cfg.getSagexPoolSize(),
+                 cfg.getSagexPoolTimeout())
+    cfg.log.info('sagex index: %s [%ss]', cfg.getSagexIndex(),
+                 cfg.getSagexIndexTtl())
+    cfg.log.info('sagex profiles: %s', cfg.getSagexProfiles())
     cfg.log.info('PLEX_HOST: %s', cfg.getPlexHost())
     cfg.log.info('scanner ext: %s', cfg.getScannerExt())
     cfg.log.info('scanner log: %s', cfg.getScannerLog())
+    cfg.log.info('scanner warm up: %s', cfg.getScannerWarmUp())
+    cfg.log.info('scanner sidecar: %s', cfg.getScannerSidecar())
     cfg.log.info('agent locking: %s', cfg.getAgentLocking())
+    cfg.log.info('agent limits: api %s, fanart %s',
+                 cfg.getAgentApiLimit(), cfg.getAgentFanartLimit())
+    cfg.log.info('agent batch window: %s', cfg.getAgentBatchWindow())
+    cfg.log.info('agent series cache: %s [%ss]', cfg.getAgentSeriesCacheSize(),
+                 cfg.getAgentSeriesCacheTtl())
     cfg.log.info('plex token: %s', cfg.getPlexToken())
+    cfg.log.info('plex page size: %s', cfg.getPlexPageSize())
+    cfg.log.info('plex walk workers: %s', cfg.getPlexWalkWorkers())
+    cfg.log.info('sync state: %s', cfg.getSyncStateFile())
+    cfg.log.info('sync reverify: %ss', cfg.getSyncReverify())
+    cfg.log.info('sync daemon: %ss/%ss, control port %s',
+                 cfg.getSyncInterval(), cfg.getSyncFastInterval(),
+                 cfg.getSyncControlPort())
+    cfg.log.info('cache: %s', cfg.getCacheFile())
 
 #if __name__ == '__main__':
 #    import sys, logging
@@ -0,0 +1,78 @@
+#####################################################################
+#
+# Author:  Raymond Chi
+#
+# Module that implements a small thread-safe LRU cache with a
+# time-to-live on each entry. Work under both scanner (standalone
+# python) and agent (PMS framework)
+#
+######################################################################
+
+import collections, threading, time
+
+
+######################################################################
+# LruCache class
+######################################################################
+
+class LruCache(object):
+    '''LRU cache where entries also expire after ttl seconds
+
+    None is a valid value to cache, which allows negative caching, ie,
+    remembering that a lookup returned nothing. So get() returns a
+    (found, value) tuple instead of just the value.
+    '''
+
+    def __init__(self, maxSize, ttl):
+        '''Creates a LruCache object
+
+        @param maxSize  max number of entries, least recently used
+                        entries are dropped beyond this
+        @param ttl      [s] time an entry stays valid
+        '''
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.data = collections.OrderedDict()  # key -> (expires, value)
+        self.lock = threading.Lock()
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''Look up an entry
+
+        @param key  key to look up
+        @return     (True, value) if found, else (False, None)
+        '''
+        with self.lock:
+            entry = self.data.pop(key, None)
+            if entry and entry[0] > time.time():
+                self.data[key] = entry  # re-insert as most recent
+                self.hits += 1
+                return (True, entry[1])
+            self.misses += 1
+            return (False, None)
+
+    def put(self, key, value):
+        '''Add or replace an entry
+
+        @param key    key of entry
+        @param value  value to store, can be None
+        '''
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = (time.time() + self.ttl, value)
+            while len(self.data) > self.maxSize:
+                self.data.popitem(last=False)  # least recently used
+
+    def getStats(self):
+        '''Return cache statistics as a string'''
+        total = self.hits + self.misses
+        rate = (100.0 * self.hits / total) if total else 0.0
+        return ('%d/%d entries, %d hits, %d misses (%.0f%% hit rate)' %
+                (len(self.data), self.maxSize, self.hits, self.misses, rate))
+
+
+# useful stuff
+# python falsy values: None/False/0/''/{}
+# function implicit return: None
@@ -0,0 +1,257 @@
+#####################################################################
+#
+# Author:  Raymond Chi
+#
+# Module that implements a persistent on-disk cache of SageTV
+# MediaFile objects, shared by the scanner and the sync tool.
+#
+# PMS runs the scanner in a new process for every scan, so without
+# this every rescan asks SageTV again about files it already resolved
+# the last time. Entries are keyed by file name and SageX profile, and
+# validated against the file size/mtime, so a changed file is always
+# fetched again.
+#
+# It also keeps the scan items of spscan, ie, how a MediaFile was
+# classified and parsed, so when the TV and Movie scanners scan the
+# same folder, the second one reuses the work of the first.
+#
+######################################################################
+
+import json, time, threading
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+import plexlog  # log wrapper for scanner/agent
+
+DEFAULT_TTL = 7*24*60*60     # [s] entries older than this are ignored
+DEFAULT_MAX_ENTRIES = 50000  # oldest entries are evicted beyond this
+
+# bump when the table changes, older cache files are then emptied
+SCHEMA_VERSION = 2
+
+
+######################################################################
+# MediaFileCache class
+######################################################################
+
+class MediaFileCache(object):
+    '''SQLite backed cache of MediaFile objects by file name'''
+
+    def __init__(self, filename, ttl=DEFAULT_TTL,
+                 maxEntries=DEFAULT_MAX_ENTRIES, log=None):
+        '''Creates a MediaFileCache object
+
+        If the cache can't be opened (no sqlite3 module, bad path,
+        etc), the object is still created but get() always misses and
+        put() does nothing.
+
+        @param filename    path to the sqlite database file
+        @param ttl         [s] max age of an entry
+        @param maxEntries  max number of entries to keep
+        @param log         plexlog obj, or None
+        '''
+        if ttl is None:
+            ttl = DEFAULT_TTL
+        if maxEntries is None:
+            maxEntries = DEFAULT_MAX_ENTRIES
+        self.log = log if log else plexlog.PlexLog()
+        self.filename = filename
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.lock = threading.Lock()
+        self.db = None
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+        if not sqlite3:
+            self.log.warning('MediaFileCache: sqlite3 not available, cache disabled')
+            return
+        try:
+            self.db = sqlite3.connect(filename, timeout=30,
+                                      check_same_thread=False)
+            version = self.db.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                self.db.execute('DROP TABLE IF EXISTS mediafile')
+                self.db.execute('DROP TABLE IF EXISTS scanitem')
+                self.db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+            self.db.execute('CREATE TABLE IF NOT EXISTS mediafile ('
+                            ' name TEXT NOT NULL,'
+                            ' profile TEXT NOT NULL,'
+                            ' size INTEGER,'
+                            ' mtime INTEGER,'
+                            ' fetched REAL NOT NULL,'
+                            ' data TEXT NOT NULL,'
+                            ' PRIMARY KEY (name, profile))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS mediafile_fetched'
+                            ' ON mediafile (fetched)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS scanitem ('
+                            ' name TEXT PRIMARY KEY,'
+                            ' size INTEGER,'
+                            ' mtime INTEGER,'
+                            ' fetched REAL NOT NULL,'
+                            ' data TEXT NOT NULL)')
+            self.db.commit()
+            self.evict()
+            self.log.debug('MediaFileCache: %s', filename)
+        except sqlite3.Error, e:
+            self.log.error('MediaFileCache: failed to open %s: %s', filename, e)
+            self.db = None
+
+    def get(self, name, size, mtime=None, profile=None):
+        '''Return the cached MediaFile for a file
+
+        An entry is only used if it is within ttl, its size (and mtime
+        if both sides know it) matches the file, and it is a complete
+        MediaFile or was fetched with one of the caller's profiles. If
+        more than one is cached, the newest is returned.
+
+        @param name     UTF-8 encoded filename such as Myshow.mkv
+        @param size     file size in bytes
+        @param mtime    file modification time [s], or None if unknown
+        @param profile  SageX profile of the caller, or a list of the
+                        profiles it can use, None for complete
+                        MediaFile objects
+        @return         json[MediaFile] or None
+        '''
+        if not self.db:
+            return
+        if not profile or isinstance(profile, basestring):
+            profile = [profile or '']
+        try:
+            with self.lock:
+                rows = self.db.execute('SELECT size, mtime, fetched, data'
+                                       ' FROM mediafile WHERE name = ?'
+                                       ' AND profile IN (\'\'%s)'
+                                       ' ORDER BY fetched DESC'
+                                       % (', ?' * len(profile)),
+                                       [name.decode('utf-8')] +
+                                       list(profile)).fetchall()
+        except sqlite3.Error, e:
+            self.log.error('MediaFileCache.get: %s', e)
+            return
+        for row in rows:
+            if (time.time() - row[2] <= self.ttl and
+                    row[0] == size and
+                    (mtime is None or row[1] is None or
+                     row[1] == int(mtime))):
+                self.hits += 1
+                return json.loads(row[3])
+        self.misses += 1
+
+    def put(self, name, mf, size, mtime=None, profile=None):
+        '''Add or replace the cached MediaFile for a file
+
+        Only the entry of the same profile is replaced, so a trimmed
+        MediaFile doesn't take the place of a complete one.
+
+        @param name     UTF-8 encoded filename such as Myshow.mkv
+        @param mf       json[MediaFile]
+        @param size     file size in bytes
+        @param mtime    file modification time [s], or None if unknown
+        @param profile  SageX profile mf was fetched with, None if it
+                        is a complete MediaFile object
+        '''
+        if not self.db:
+            return
+        if mtime is not None:
+            mtime = int(mtime)
+        try:
+            with self.lock:
+                self.db.execute('INSERT OR REPLACE INTO mediafile'
+                                ' (name, profile, size, mtime, fetched, data)'
+                                ' VALUES (?, ?, ?, ?, ?, ?)',
+                                (name.decode('utf-8'), profile or '', size,
+                                 mtime, time.time(), json.dumps(mf)))
+                self.db.commit()
+        except sqlite3.Error, e:
+            self.log.error('MediaFileCache.put: %s', e)
+
+    def getScanItem(self, name, size, mtime=None):
+        '''Return the cached scan item for a file
+
+        Same validation as get(), without the profile.
+
+        @param name     UTF-8 encoded filename such as Myshow.mkv
+        @param size     file size in bytes
+        @param mtime    file modification time [s], or None if unknown
+        @return         scan item dict or None
+        '''
+        if not self.db:
+            return
+        try:
+            with self.lock:
+                row = self.db.execute('SELECT size, mtime, fetched, data'
+                                      ' FROM scanitem WHERE name = ?',
+                                      (name.decode('utf-8'),)).fetchone()
+        except sqlite3.Error, e:
+            self.log.error('MediaFileCache.getScanItem: %s', e)
+            return
+        if (not row or
+                time.time() - row[2] > self.ttl or
+                row[0] != size or
+                (mtime is not None and row[1] is not None and
+                 row[1] != int(mtime))):
+            self.misses += 1
+            return
+        self.hits += 1
+        return json.loads(row[3])
+
+    def putScanItem(self, name, item, size, mtime=None):
+        '''Add or replace the cached scan item for a file
+
+        @param name     UTF-8 encoded filename such as Myshow.mkv
+        @param item     scan item dict, json serializable
+        @param size     file size in bytes
+        @param mtime    file modification time [s], or None if unknown
+        '''
+        if not self.db:
+            return
+        if mtime is not None:
+            mtime = int(mtime)
+        try:
+            with self.lock:
+                self.db.execute('INSERT OR REPLACE INTO scanitem'
+                                ' (name, size, mtime, fetched, data)'
+                                ' VALUES (?, ?, ?, ?, ?)',
+                                (name.decode('utf-8'), size, mtime,
+                                 time.time(), json.dumps(item)))
+                self.db.commit()
+        except sqlite3.Error, e:
+            self.log.error('MediaFileCache.putScanItem: %s', e)
+
+    def evict(self):
+        '''Remove expired entries and trim cache to maxEntries'''
+        expired = 0
+        trimmed = 0
+        with self.lock:
+            for table in ('mediafile', 'scanitem'):
+                cur = self.db.execute('DELETE FROM %s WHERE fetched < ?'
+                                      % table, (time.time() - self.ttl,))
+                expired += cur.rowcount
+                cur = self.db.execute('DELETE FROM %s WHERE rowid IN'
+                                      ' (SELECT rowid FROM %s'
+                                      '  ORDER BY fetched DESC LIMIT -1 OFFSET ?)'
+                                      % (table, table), (self.maxEntries,))
+                trimmed += cur.rowcount
+            self.db.commit()
+        if expired or trimmed:
+            self.log.info('MediaFileCache: evicted %d expired, %d over limit',
+                          expired, trimmed)
+
+    def close(self):
+        '''Close the cache database'''
+        if self.db:
+            self.log.debug('MediaFileCache: %d hits, %d misses',
+                           self.hits, self.misses)
+            with self.lock:
+                self.db.close()
+                self.db = None
+
+
+# useful stuff
+# python falsy values: None/False/0/''/{}
+# function implicit return: None
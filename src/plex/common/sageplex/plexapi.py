@@ -6,14 +6,20 @@
 #
 ######################################################################
 
-import urllib, urllib2
+import urllib, urllib2, urlparse, base64, threading
 
 try:
     import xml.etree.cElementTree as ET
 except ImportError:
     import xml.etree.ElementTree as ET
 
-import plexlog  # log wrapper for scanner/agent
+import plexlog   # log wrapper for scanner/agent
+import httpconn  # response decompression
+import spvideo   # PlexVideo
+import workpool  # parallel walkPlex
+
+# items fetched per request when paging through a container
+DEFAULT_PAGE_SIZE = 200
 
 import pdb
 
@@ -25,11 +31,16 @@ import pdb
 class PlexApi(object):
     '''Class that implements some PLEX APIs via HTTP interface'''
 
-    def __init__(self, plexHost, log=None, token=None):
+    def __init__(self, plexHost, log=None, token=None, pageSize=None,
+                 walkWorkers=None):
         '''Creates a PlexApi object
 
         @param plexHost  url such as http://host:port/
         @param log       plexlog obj from Agent, or None
+        @param token     PLEX access token, or None
+        @param pageSize  items per request for iterVideos()
+        @param walkWorkers  threads walkPlex() fetches with, None or 1
+                            to fetch one container at a time
         '''
         self.appid = 'com.plexapp.plugins.library'
         # setup log
@@ -49,6 +60,13 @@ class PlexApi(object):
             self.log.error('PlexApi: plexHost not specified!!')
         # store token value
         self.PLEX_TOKEN = token
+        self.pageSize = pageSize or DEFAULT_PAGE_SIZE
+        self.walkWorkers = walkWorkers or 1
+        # statistics
+        self.lock = threading.Lock()
+        self.requests = 0   # requests made
+        self.wireBytes = 0  # response bytes received
+        self.dataBytes = 0  # response bytes after decompression
 
     def addToken(self, url):
         '''Add the PLEX token to the URL'''
@@ -65,7 +83,7 @@ class PlexApi(object):
     def openUrl(self, url, xml=False, log=True):
         '''Open the url and get the data returned
 
-        This uses urllib and default HTTP GET
+        This uses urllib2 and default HTTP GET
 
         @param url  URL to open
         @param xml  whether to return data as XML object
@@ -81,11 +99,19 @@ class PlexApi(object):
             # we can't use the framework's HTTPRequest() or
             # JSON.ObjectFromURL() because it apparently doesn't know
             # how to deal with url that have user/password
-            input = urllib.urlopen(url)
-            result = input.read()
+            req = self.makeRequest(url)
+            try:
+                response = urllib2.urlopen(req)
+            except urllib2.HTTPError, e:
+                # urllib.urlopen() returned the body of an error status
+                # as if it was a success, keep doing that so callers see
+                # the same data they always did
+                self.log.warning("openUrl: HTTP %d on: %s", e.code, url)
+                response = e
+            result = self.readResponse(response)
             if result and xml:
                 result = ET.fromstring(result)
-        except IOError, e:
+        except IOError, e:  # includes urllib2.URLError
             self.log.error("openUrl: failed on: %s: %s", url, str(e))
             result = None
         except ET.ParseError, e:
@@ -96,6 +122,84 @@ class PlexApi(object):
 
         return result
 
+    def makeRequest(self, url):
+        '''Create a urllib2 request for the url
+
+        urllib2 doesn't handle user:pwd@ urls the way urllib does, so
+        the credentials are moved into a basic-auth header.
+
+        @param url  URL to open
+        @return     urllib2.Request asking for a compressed response
+        '''
+        u = urlparse.urlsplit(url)
+        auth = None
+        if u.username is not None:
+            netloc = u.hostname
+            if u.port:
+                netloc += ':%d' % u.port
+            url = urlparse.urlunsplit((u.scheme, netloc, u.path,
+                                       u.query, u.fragment))
+            cred = '%s:%s' % (urllib.unquote(u.username),
+                              urllib.unquote(u.password or ''))
+            auth = 'Basic ' + base64.b64encode(cred)
+        req = urllib2.Request(url)
+        req.add_header('Accept-Encoding', httpconn.ACCEPT_ENCODING)
+        if auth:
+            req.add_header('Authorization', auth)
+        return req
+
+    def readResponse(self, response):
+        '''Read and decompress the body of a urllib2 response
+
+        @param response  response from urllib2.urlopen()
+        @return          response body
+        @raise IOError   on read/decoding errors
+        '''
+        reader = httpconn.DecodingReader(response,
+                                         response.info().getheader('Content-Encoding'))
+        try:
+            data = reader.read()
+        finally:
+            self.countResponse(reader)
+        return data
+
+    def openStream(self, url, headers=None):
+        '''Open the url to read the response as a stream
+
+        @param url      URL to open
+        @param headers  dict of additional request headers
+        @return         httpconn.DecodingReader of the response, call
+                        countResponse() once done with it
+        @raise IOError  on connection/HTTP errors
+        '''
+        url = self.addToken(url)
+        self.log.debug('openStream: %s %s', url, headers or '')
+        req = self.makeRequest(url)
+        for (k, v) in (headers or {}).items():
+            req.add_header(k, v)
+        response = urllib2.urlopen(req)
+        return httpconn.DecodingReader(response,
+                                       response.info().getheader('Content-Encoding'))
+
+    def countResponse(self, reader):
+        '''Close a response and add it to the statistics
+
+        @param reader  httpconn.DecodingReader of the response
+        '''
+        reader.response.close()
+        with self.lock:
+            self.requests += 1
+            self.wireBytes += reader.wireBytes
+            self.dataBytes += reader.dataBytes
+        self.log.debug('countResponse: %d bytes, %d on wire [%s]',
+                       reader.dataBytes, reader.wireBytes,
+                       reader.encoding or 'identity')
+
+    def logStats(self):
+        '''Write PlexApi usage statistics to the log'''
+        self.log.info('PlexApi: %d requests, %d bytes read, %d on wire',
+                      self.requests, self.dataBytes, self.wireBytes)
+
     def getApiUrl(self, action, values):
         '''Generate the URL we need to make the PLEX API call
 
@@ -177,16 +281,42 @@ class PlexApi(object):
         else:
             return path + '/' + newPath
 
-    def walkPlex(self, path, key, leafCb, level=1):
+    def walkPlex(self, path, key, leafCb, level=1, workers=None):
         '''A recursive function to walk the PLEX library tree
 
         A callback function can be specified to do something useful at
         each leaf node, ie, a node that contains video elements.
 
-        @param path    path to walk, ie, /library/sections
-        @param key     the key that lead to this path
-        @param leafCb  callback function when at leaf node
-        @param level   internal, recursion depth
+        With more than 1 worker, child containers are fetched ahead in
+        parallel, but leafCb is still called from the calling thread
+        and in the same order as a sequential walk.
+
+        @param path     path to walk, ie, /library/sections
+        @param key      the key that lead to this path
+        @param leafCb   callback function when at leaf node
+        @param level    internal, recursion depth
+        @param workers  number of fetch threads, default is from
+                        __init__, 1 to fetch one container at a time
+        '''
+        if workers is None:
+            workers = self.walkWorkers
+        if workers > 1:
+            pool = workpool.WorkerPool(workers, 'walkPlex')
+            try:
+                self.walkContainer(self.getContainer(path, level),
+                                   path, key, leafCb, level, pool)
+            finally:
+                pool.close()
+        else:
+            self.walkContainer(self.getContainer(path, level),
+                               path, key, leafCb, level, None)
+
+    def getContainer(self, path, level):
+        '''Fetch a <MediaContainer> for walkPlex()
+
+        @param path   path to fetch
+        @param level  recursion depth of path
+        @return       XML <MediaContainer> with children, or None
         '''
         # just in case, bail out if recursed too deep
         if level > 7:
@@ -210,6 +340,31 @@ class PlexApi(object):
             self.log.warning("walkPlex: <%s> size=%s, skipping",
                              TAG_TYPE, ans.get('size'))
             return
+        return ans
+
+    def walkContainer(self, ans, path, key, leafCb, level, pool):
+        '''Walk the children of a container fetched by getContainer()
+
+        @param ans     XML <MediaContainer>, or None
+        @param path    path ans was fetched from
+        @param key     the key that lead to this path
+        @param leafCb  callback function when at leaf node
+        @param level   recursion depth
+        @param pool    workpool.WorkerPool to fetch children, or None
+        '''
+        if ans is None:
+            return
+        # find the children to recurse into, so their containers can
+        # be fetched ahead while we work through the earlier ones
+        subPaths = []
+        for e1 in ans:
+            childKey = e1.attrib['key']
+            if (e1.tag == 'Video' or key == childKey or
+                    e1.attrib['title'] == 'All episodes'):
+                continue
+            subPaths.append(self.joinPath(path, childKey))
+        fetched = []  # Futures of subPaths[0:len(fetched)]
+        sub = 0       # index of the next subPaths to walk
         # now loop through the child elements
         for e1 in ans:
             title = e1.attrib['title']
@@ -227,8 +382,141 @@ class PlexApi(object):
                 self.log.debug("%sSkipping %s", '  ' * level, title)
                 continue
             # append key to path, and recurse
-            newPath = self.joinPath(path, childKey)
-            self.walkPlex(newPath, childKey, leafCb, level+1)
+            newPath = subPaths[sub]
+            if pool:
+                # keep up to pool.size fetches ahead of the walk
+                while (len(fetched) < len(subPaths) and
+                       len(fetched) <= sub + pool.size):
+                    fetched.append(pool.submit(self.getContainer,
+                                               subPaths[len(fetched)],
+                                               level+1))
+                child = fetched[sub].result()
+                fetched[sub] = None  # walked, free it
+            else:
+                child = self.getContainer(newPath, level+1)
+            sub += 1
+            self.walkContainer(child, newPath, childKey, leafCb, level+1,
+                               pool)
+
+    def walkSection(self, sectionId, leafCb):
+        '''Call leafCb on every video of a library section
+
+        Uses /library/sections/<id>/allLeaves, which lists all the
+        episodes (or movies) of a section in a few paged requests,
+        instead of one request per show and season like walkPlex().
+
+        @param sectionId  PLEX library section id
+        @param leafCb     callback function for each <Video> element
+        @return           True if the whole section was listed, False
+                          if it could not be listed or a page failed
+                          part way. leafCb has then seen only some of
+                          the videos, walkPlex() can be used then
+        '''
+        path = '/library/sections/%s/allLeaves' % sectionId
+        count = 0
+        try:
+            for e1 in self.iterVideos(path):
+                count += 1
+                self.log.debug("  %s (%s)", e1.get('title'), e1.get('key'))
+                if leafCb:
+                    leafCb(e1, self.log)
+        except IOError, e:
+            self.log.error("walkSection: %s: failed after %d videos: %s",
+                           path, count, str(e))
+            return False
+        self.log.debug("walkSection: %s: %d videos", path, count)
+        return True
+
+    def iterVideos(self, path, pageSize=None):
+        '''Generator of the <Video> elements of a PLEX container
+
+        The container is fetched in pages using the
+        X-Plex-Container-Start/Size headers, and each page is parsed
+        while it downloads. An element is cleared as soon as the
+        caller moves on to the next one, so memory use stays the same
+        regardless of the container size. Copy what you need from an
+        element, don't keep it.
+
+        @param path      path such as /library/sections/1/allLeaves
+        @param pageSize  items per request, default is from __init__
+        @return          generator of XML <Video> elements
+        @raise IOError   if a page can't be fetched or parsed
+        '''
+        TAG_TYPE = 'MediaContainer'
+        if not pageSize:
+            pageSize = self.pageSize
+        url = ('%s%s' % (self.PLEX_HOST, path))
+        start = 0
+        while True:
+            reader = self.openStream(url,
+                                     {'X-Plex-Container-Start': str(start),
+                                      'X-Plex-Container-Size': str(pageSize)})
+            count = 0
+            total = None
+            try:
+                root = None
+                for (event, elem) in ET.iterparse(reader, ('start', 'end')):
+                    if root is None:
+                        if elem.tag != TAG_TYPE:
+                            raise IOError('expecting <%s> but got: <%s>' %
+                                          (TAG_TYPE, elem.tag))
+                        root = elem
+                        total = elem.get('totalSize')
+                    elif event == 'end' and elem.tag == 'Video':
+                        count += 1
+                        yield elem
+                        root.clear()  # drop the videos consumed so far
+            except ET.ParseError, e:
+                raise IOError('XML parse failed: %s' % str(e))
+            finally:
+                self.countResponse(reader)
+            start += count
+            # done on a short page. also stop if the server ignored the
+            # page size and returned more, or we'd read it all again
+            if count != pageSize or (total and start >= int(total)):
+                return
+
+    def iterChangedVideos(self, sectionId, since):
+        '''Generator of the <Video> elements changed since a watermark
+
+        For each attribute in since, lists the section's videos newest
+        first by that attribute, and stops at the first video older
+        than the watermark. So unchanged videos are mostly never
+        downloaded. A video is only returned once even if it changed
+        in several ways.
+
+        @param sectionId  PLEX library section id
+        @param since      dict of attribute -> time [s], such as
+                          {'lastViewedAt': 1428473070}
+        @return           generator of XML <Video> elements
+        @raise IOError    if a page can't be fetched or parsed
+        '''
+        seen = set()
+        for (attr, mark) in sorted(since.items()):
+            path = ('/library/sections/%s/allLeaves?sort=%s:desc' %
+                    (sectionId, attr))
+            for e1 in self.iterVideos(path):
+                if int(e1.get(attr) or 0) < mark:
+                    break  # the rest are older
+                key = e1.get('ratingKey')
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield e1
+
+    def iterPlexVideos(self, path, pageSize=None):
+        '''Generator of PlexVideo objects of a PLEX container
+
+        See iterVideos(), the PlexVideo copies what it needs from the
+        element so it can be kept.
+
+        @param path      path such as /library/sections/1/allLeaves
+        @param pageSize  items per request, default is from __init__
+        @return          generator of spvideo.PlexVideo
+        @raise IOError   if a page can't be fetched or parsed
+        '''
+        for e1 in self.iterVideos(path, pageSize):
+            yield spvideo.PlexVideo(e1, self.log)
 
     def openUrlPost(self, url, values={}, xml=True, method='POST'):
         '''Open the url and get the data returned
@@ -262,17 +550,16 @@ class PlexApi(object):
         #
         # another option is to pass data in as 2nd parameter to
         # Request(), but doing that doesn't seem as elegant
-        req = urllib2.Request(url)
+        req = self.makeRequest(url)
         req.get_method = lambda: method  # override method
 
         result = None
         try:
             self.log.debug('openUrlPost[%s]: %s', method, url)
-            response = urllib2.urlopen(req)
-            result = response.read()
+            result = self.readResponse(urllib2.urlopen(req))
             if result and xml:
                 result = ET.fromstring(result)
-        except urllib2.URLError, e:
+        except IOError, e:  # includes urllib2.URLError
             self.log.error("openUrlPost[%s]: failed: %s", method, str(e))
             result = None
         except ET.ParseError, e:
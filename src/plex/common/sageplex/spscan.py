@@ -0,0 +1,568 @@
+#####################################################################
+#
+# Author:  Raymond Chi
+#
+# Module with the scanning core shared by the SageTV TV and Movie
+# scanners. Work under scanner (standalone python)
+#
+# A SageTV MediaFile is classified once, as a TV show or a movie, and
+# parsed into a scan item holding just what the scanners need to
+# create their Media objects. Scan items are kept in the MediaFile
+# cache, so when both scanners are pointed at the same recordings
+# folder the second one neither asks SageTV nor parses again.
+#
+# Optionally, the .properties metadata files Sage/BMT write next to
+# the media files are read instead, so a directory of recordings with
+# sidecars is scanned without asking SageTV at all.
+#
+######################################################################
+
+import os, re, time, datetime
+
+import plexlog  # log wrapper for scanner/agent
+
+# scan item kinds
+KIND_TV = 'tv'
+KIND_MOVIE = 'movie'
+KIND_OTHER = 'other'  # not a recording either scanner adds
+
+# metadata sidecar of Myshow.mpg: Myshow.mpg.properties or Myshow.properties
+SIDECAR_EXT = '.properties'
+
+
+######################################################################
+# classification and parsing
+######################################################################
+
+def classify(mf, show, log):
+    '''Return whether a MediaFile is a recorded TV show or movie
+
+    @param mf    MediaFile obj from sage
+    @param show  mf['Airing']['Show']
+    @param log   plexlog obj
+    @return      KIND_TV, KIND_MOVIE or KIND_OTHER
+    '''
+    # check if this is a sage recording or not
+    if not mf.get('IsTVFile'):
+        log.warning('File is NOT TV recording! skipping')
+        return KIND_OTHER
+
+    # MediaFileMetadataProperties/MediaType of Movie wins
+    props = mf.get('MediaFileMetadataProperties')
+    if props:
+        mediaType = props.get('MediaType')
+        if mediaType:
+            if 'Movie' in mediaType:
+                log.debug('MediaType says Movie')
+                return KIND_MOVIE
+            log.debug('MediaType is %s, continuing checks...', mediaType)
+        else:
+            log.debug('MediaType not Found....')
+    else:
+        log.debug('MediaFileMetadataProperties not Found....')
+
+    # now check category
+    category = show.get('ShowCategoriesList')
+    if not category:
+        log.warning('No ShowCategoriesList! skipping')
+        return KIND_OTHER
+    if 'Movie' in category:
+        log.debug('Show is a movie: %s', category)
+        return KIND_MOVIE
+    return KIND_TV
+
+def parseEpisode(item, airing, show, log):
+    '''Add the Media.Episode values of a TV show to a scan item
+
+    @param item    scan item dict to update
+    @param airing  mf['Airing']
+    @param show    airing['Show']
+    @param log     plexlog obj
+    '''
+    showTitle = show.get('ShowTitle').encode('UTF-8')
+    log.debug('ShowTitle: %s', showTitle)
+
+    episodeTitle = show.get('ShowEpisode').encode('UTF-8')
+    log.debug('ShowEpisode: %s', episodeTitle)
+    if not episodeTitle:
+        log.warning('Using Title as Episode')
+        episodeTitle = showTitle
+
+    # Try and get show year, if show year is blank,
+    # then try using original airdate, if
+    # originalairdate is blank use recordeddate year
+    showYear = show.get('ShowYear').encode('UTF-8')
+    log.debug('ShowYear: %s', showYear)
+
+    # always try to get the airDate as we need it later
+    airDate = None
+    startTime = float(show.get('OriginalAiringDate') // 1000)
+    recordTime = float(airing.get('AiringStartTime') // 1000)
+    if (startTime > 0):
+        airDate = datetime.date.fromtimestamp(startTime)
+    elif (recordTime > 0):
+        airDate = datetime.date.fromtimestamp(recordTime)
+    else:
+        airDate = datetime.datetime.now()
+        log.warning('No OriginalAiringDate/AiringStartTime! '
+                    'Using today as airDate: %s', airDate)
+
+    if not showYear:
+        log.warning('Setting show year from airDate: %s', airDate)
+        showYear = int(airDate.year)
+    else:
+        showYear = int(showYear)
+
+    # must convert to int or else Plex throws a
+    # serialization exception
+    s_num = int(show.get('ShowSeasonNumber'))
+    log.debug('ShowSeasonNumber: %d', s_num)
+
+    # must convert to string or else Plex throws a
+    # serialization exception
+    ep_num = int(show.get('ShowEpisodeNumber'))
+    log.debug('ShowEpisodeNumber: %d', ep_num)
+
+    # if there is no season or episode number, default
+    # it to 0 so that Plex can still pull it in
+    if not ep_num:
+        # AiringIDs are strictly internal to Wiz.bin and vary from
+        # one Sage installation to another. So lets not use it.
+
+        # first try last 4 digit of ShowExternalID. This is what
+        # sage uses in its UI and represent zip2it's episode-id.
+        log.warning('No episode number, trying to set a suitable one ...')
+        programId = show.get('ShowExternalID')
+        if programId:
+            log.debug('programId: %s', programId)
+            # http://forums.schedulesdirect.org/viewtopic.php?f=8&t=41
+            # MV+10-12 digits for movies
+            # SP+10-12 digits for sports
+            # EP+SERIESID+EPISODEID for a series where episode info is known
+            # SH+SERIESID+0000 for a series where episode info is *not* known.
+            #    SERIESID could be 6 or 8 chars
+            ep_num = programId[-4:]  # last 4 chars
+
+            #  Handle this little aberration: EPtvdbs00e00
+            if ep_num.isdigit():
+                ep_num = str(int(ep_num))
+            else:
+                ep_num = 0
+
+            if ep_num == '0':  # all 0, can't use
+                log.warning('ShowExternalID[-4:] is all zero: %s', programId)
+                ep_num = None
+            else:
+                log.warning('Setting ep_num to ShowExternalID[-4:]: %s', ep_num)
+        # next we try airing date
+        if not ep_num:
+            ep_num = airDate.strftime('%Y%m%d')
+            log.warning('Setting ep_num to airDate: %s', ep_num)
+
+    if not s_num:
+        s_num = showYear
+        log.warning('Show number is 0, setting to show year: %d', s_num)
+
+    item['title'] = showTitle
+    item['episodeTitle'] = episodeTitle
+    item['season'] = s_num
+    item['episode'] = ep_num
+
+def parseMovie(item, show, log):
+    '''Add the Media.Movie values of a movie to a scan item
+
+    @param item  scan item dict to update
+    @param show  mf['Airing']['Show']
+    @param log   plexlog obj
+    '''
+    showTitle = show.get('ShowTitle').encode('UTF-8')
+    log.debug('ShowTitle: %s', showTitle)
+
+    showYear = show.get('ShowYear').encode('UTF-8')
+    log.debug('ShowYear: %s', showYear)
+
+    item['title'] = showTitle
+    item['year'] = showYear or ''
+
+def parseMediaFile(mf, log):
+    '''Classify and parse a MediaFile into a scan item
+
+    A scan item is a dict with:
+      kind          KIND_TV, KIND_MOVIE or KIND_OTHER
+      segments      NumberOfSegments of the recording
+      title         show title (TV, movie)
+      episodeTitle  episode title (TV)
+      season        season number (TV)
+      episode       episode number or id (TV)
+      year          year, '' if unknown (movie)
+
+    @param mf   MediaFile obj from sage
+    @param log  plexlog obj
+    @return     scan item dict, or None if mf is unusable
+    '''
+    # retrieving the airing/show field that should always exist
+    airing = mf.get('Airing')
+    if not airing:
+        log.error('no Airing field, skipping file')
+        return
+    show = airing.get('Show')
+    if not show:
+        log.error('no [Airing][Show] field, skipping file')
+        return
+
+    item = {'kind': classify(mf, show, log),
+            'segments': mf.get('NumberOfSegments')}
+    if item['kind'] == KIND_TV:
+        parseEpisode(item, airing, show, log)
+    elif item['kind'] == KIND_MOVIE:
+        parseMovie(item, show, log)
+    return item
+
+def parseScanItem(mf, filename, log):
+    '''Classify and parse the MediaFile of one file of a directory scan
+
+    Each file is parsed as TV show or movie whichever scanner runs, so
+    a MediaFile one of the parsers chokes on only skips that file, not
+    the rest of the directory.
+
+    @param mf        MediaFile obj from sage
+    @param filename  filename, for the log
+    @param log       plexlog obj
+    @return          scan item dict, or None if mf is unusable
+    '''
+    try:
+        return parseMediaFile(mf, log)
+    except Exception, e:
+        log.error('failed to parse %s, skipping file: %s: %s', filename,
+                  type(e).__name__, e)
+
+
+def decodeItem(item):
+    '''Return a scan item read back from json with UTF-8 str values
+
+    @param item  scan item dict from json.loads
+    @return      scan item dict as returned by parseMediaFile()
+    '''
+    return dict([(str(k), v.encode('UTF-8') if isinstance(v, unicode) else v)
+                 for (k, v) in item.items()])
+
+
+######################################################################
+# .properties sidecars
+######################################################################
+
+PROPERTY_ESCAPES = {'t': u'\t', 'n': u'\n', 'r': u'\r', 'f': u'\f'}
+
+def unescapeProperty(s):
+    '''Return a .properties key or value with its escapes resolved
+
+    @param s  unicode string as written in the file
+    @return   unicode string
+    '''
+    def repl(m):
+        c = m.group(1)
+        if len(c) == 5:  # uXXXX
+            return unichr(int(c[1:], 16))
+        return PROPERTY_ESCAPES.get(c, c)
+    return re.sub(r'\\(u[0-9a-fA-F]{4}|.)', repl, s)
+
+def parseProperties(data):
+    '''Parse a java .properties file
+
+    Supports comments, key=value, key:value and key value lines, line
+    continuations and escapes.
+
+    @param data  unicode content of the file
+    @return      dict of key -> value
+    '''
+    props = {}
+    logical = u''
+    for line in data.splitlines():
+        line = line.lstrip()
+        if not logical and (not line or line[0] in u'#!'):
+            continue
+        # an odd number of trailing backslashes continues the line
+        if (len(line) - len(line.rstrip(u'\\'))) % 2:
+            logical += line[:-1]
+            continue
+        logical += line
+        m = re.match(r'((?:\\.|[^\\=:\s])*)\s*[=:]?\s*(.*)$', logical,
+                     re.S)
+        props[unescapeProperty(m.group(1))] = unescapeProperty(m.group(2))
+        logical = u''
+    return props
+
+def readSidecar(path, log):
+    '''Read a .properties sidecar
+
+    BMT writes them as UTF-8, older ones may be ISO-8859-1 as java
+    expects.
+
+    @param path  full path to the .properties file
+    @param log   plexlog obj
+    @return      dict of property -> unicode value, or None on error
+    '''
+    try:
+        f = open(path, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+    except IOError, e:
+        log.warning('readSidecar: %s', e)
+        return
+    try:
+        data = data.decode('utf-8')
+    except UnicodeDecodeError:
+        data = data.decode('iso-8859-1')
+    return parseProperties(data)
+
+# SageTV names recordings Title-Episode-AiringID-Segment.ext
+RECORDING_NAME = re.compile(r'^(.+-\d+)-(\d+)(\.[^.]+)$')
+
+# date formats accepted for sidecar times given as text
+PROPERTY_DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S',
+                         '%Y-%m-%dT%H:%M:%S', '%Y%m%d')
+
+def propertyInt(props, key):
+    '''Return an integer property, 0 if missing or not a number'''
+    try:
+        return int(props.get(key) or 0)
+    except ValueError:
+        return 0
+
+def propertyBool(props, key):
+    '''Return a true/false property, None if missing or not a boolean'''
+    val = (props.get(key) or u'').strip().lower()
+    if val in (u'true', u'yes', u'1'):
+        return True
+    if val in (u'false', u'no', u'0'):
+        return False
+
+def propertyTime(props, key, log):
+    '''Return a time property in ms like sagex times
+
+    The value can be ms since the epoch, or a local date or date and
+    time such as 2015-03-30.
+
+    @param props  dict of property -> unicode value
+    @param key    property name
+    @param log    plexlog obj
+    @return       [ms] time, or None if missing or not a time
+    '''
+    val = (props.get(key) or u'').strip()
+    if not val:
+        return
+    if val.isdigit():
+        return int(val)
+    for fmt in PROPERTY_DATE_FORMATS:
+        try:
+            t = datetime.datetime.strptime(val, fmt)
+        except ValueError:
+            continue
+        return int(time.mktime(t.timetuple())) * 1000
+    log.warning('sidecar %s is not a time: %s', key, val)
+
+def countSegments(filename, names):
+    '''Return the number of segment files of a SageTV recording
+
+    @param filename  file name of one of the segments
+    @param names     set of the file names in its directory
+    @return          number of segments, 0 if filename isn't named
+                     like a SageTV recording
+    '''
+    m = RECORDING_NAME.match(filename)
+    if not m:
+        return 0
+    (prefix, ext) = (m.group(1), m.group(3))
+    count = 0
+    for name in names:
+        n = RECORDING_NAME.match(name)
+        if n and n.group(1) == prefix and n.group(3) == ext:
+            count += 1
+    return count
+
+def sidecarMediaFile(props, filename, names, log):
+    '''Return a MediaFile like dict built from a sidecar
+
+    Only the fields parseMediaFile() uses are filled in, so sidecars
+    are classified and parsed the same way as MediaFiles from sagex.
+    Each field comes from the sidecar, or from the file names of the
+    recording for IsTVFile/NumberOfSegments. If the sidecar doesn't
+    say enough to classify and parse the file the way sagex would,
+    nothing is made up and None is returned, so the file is looked up
+    in SageTV instead.
+
+    @param props     dict of property -> unicode value from readSidecar()
+    @param filename  file name of the media file
+    @param names     set of the file names in its directory
+    @param log       plexlog obj
+    @return          json[MediaFile] like dict, or None
+    '''
+    segments = (propertyInt(props, 'NumberOfSegments') or
+                countSegments(filename, names))
+    isTVFile = propertyBool(props, 'IsTVFile')
+    if isTVFile is None:
+        # only SageTV recordings are named like one
+        isTVFile = True if segments else None
+    if isTVFile is None or (isTVFile and not segments):
+        log.debug('sidecar: no IsTVFile/NumberOfSegments: %s', filename)
+        return
+    if not isTVFile:
+        return {'IsTVFile': False, 'NumberOfSegments': segments,
+                'Airing': {'Show': {'ShowTitle': props.get('Title') or u''}}}
+
+    title = props.get('Title')
+    mediaType = (props.get('MediaType') or u'').strip()
+    if not title or not mediaType:
+        log.debug('sidecar: no Title/MediaType: %s', filename)
+        return
+    isMovie = mediaType.lower() == u'movie'
+    if isMovie:
+        mediaType = u'Movie'  # what classify() looks for
+    categories = [g.strip() for g in
+                  re.split(u'[/;]', props.get('Genre') or u'') if g.strip()]
+    if not categories:
+        categories = [mediaType]
+
+    airDate = propertyTime(props, 'OriginalAirDate', log)
+    startTime = propertyTime(props, 'AiringStartTime', log)
+    year = props.get('Year') or u''
+    season = propertyInt(props, 'SeasonNumber')
+    episode = propertyInt(props, 'EpisodeNumber')
+    if not (isMovie or airDate or startTime or (year and season and episode)):
+        # parseEpisode() would have to use today as the air date
+        log.debug('sidecar: no air date or year/season/episode: %s',
+                  filename)
+        return
+
+    show = {'ShowTitle': title,
+            'ShowEpisode': props.get('EpisodeName') or u'',
+            'ShowYear': year,
+            'OriginalAiringDate': airDate or 0,
+            'ShowSeasonNumber': season,
+            'ShowEpisodeNumber': episode,
+            'ShowExternalID': props.get('ExternalID') or u'',
+            'ShowCategoriesList': categories}
+    return {'IsTVFile': True,
+            'NumberOfSegments': segments,
+            'MediaFileMetadataProperties': {'MediaType': mediaType},
+            'Airing': {'AiringStartTime': startTime or 0, 'Show': show}}
+
+def findSidecar(path, listings, log):
+    '''Return the sidecar of a media file, if any
+
+    @param path      full path to the media file
+    @param listings  dict of directory -> set of its file names, filled
+                     in as needed so each directory is listed once
+    @param log       plexlog obj
+    @return          dict of property -> value, or None if no sidecar
+    '''
+    (dirname, filename) = os.path.split(path)
+    names = listings.get(dirname)
+    if names is None:
+        try:
+            names = set(os.listdir(dirname or '.'))
+        except OSError, e:
+            log.warning('findSidecar: %s', e)
+            names = set()
+        listings[dirname] = names
+    for name in (filename + SIDECAR_EXT,
+                 os.path.splitext(filename)[0] + SIDECAR_EXT):
+        if name in names:
+            return readSidecar(os.path.join(dirname, name), log)
+
+
+######################################################################
+# directory scan
+######################################################################
+
+def fileStat(path, log):
+    '''Return the size and modification time of a file
+
+    @param path  full path to file
+    @param log   plexlog obj
+    @return      (size, mtime), or (None, None) on error
+    '''
+    try:
+        st = os.stat(path)
+        return (st.st_size, st.st_mtime)
+    except OSError, e:
+        log.warning('fileStat: %s', e)
+        return (None, None)
+
+def cacheName(filename):
+    '''Return a filename the way the MediaFile cache takes it
+
+    @param filename  filename, unicode (from Plex) or str
+    @return          UTF-8 encoded filename
+    '''
+    if isinstance(filename, unicode):
+        return filename.encode('UTF-8')
+    return filename
+
+
+def getScanItems(sageapi, files, exts, log=None, sidecars=False):
+    '''Return the scan items of the files of a directory
+
+    With sidecars, files that have a usable .properties sidecar are
+    parsed from it. Scan items cached by an earlier scan of the same,
+    unchanged file, from either scanner, are used as is. The other
+    files are looked up in SageTV at once, then parsed and cached.
+
+    @param sageapi   SageX obj, its MediaFileCache if any also caches
+                     the scan items
+    @param files     list of full paths to files, unicode or UTF-8
+    @param exts      list of lower case file extensions to look up
+    @param log       plexlog obj, or None
+    @param sidecars  whether to read .properties sidecars
+    @return          dict of filename -> scan item, or None if the
+                     file is not in SageTV or is unusable
+    '''
+    log = log if log else plexlog.PlexLog()
+    cache = sageapi.cache if sageapi.cacheRead else None
+    items = {}
+    lookups = []
+    stats = {}  # filename -> (size, mtime)
+    listings = {}  # directory -> set of file names, for sidecars
+    for path in files:
+        filename = os.path.basename(path)
+        if os.path.splitext(filename)[1].lower() not in exts:
+            continue
+        if sidecars:
+            props = findSidecar(path, listings, log)
+            mf = None
+            if props is not None:
+                mf = sidecarMediaFile(props, filename,
+                                      listings[os.path.dirname(path)], log)
+            if mf:
+                log.debug('getScanItems: sidecar for %s', filename)
+                items[filename] = parseScanItem(mf, filename, log)
+                continue
+        (size, mtime) = fileStat(path, log)
+        item = None
+        if cache and size is not None:
+            item = cache.getScanItem(cacheName(filename), size, mtime)
+        if item:
+            items[filename] = decodeItem(item)
+            continue
+        stats[filename] = (size, mtime)
+        lookups.append((filename, size, mtime))
+    log.debug('getScanItems: %d from sidecar/cache, %d to look up',
+              len(items), len(lookups))
+
+    mediaFiles = sageapi.getMediaFilesForFiles(lookups)
+    for (filename, (size, mtime)) in stats.items():
+        mf = mediaFiles.get(filename)
+        item = None
+        if mf:
+            item = parseScanItem(mf, filename, log)
+        if item and sageapi.cache and size is not None:
+            sageapi.cache.putScanItem(cacheName(filename), item, size, mtime)
+        items[filename] = item
+    return items
+
+
+# useful stuff
+# python falsy values: None/False/0/''/{}
+# function implicit return: None
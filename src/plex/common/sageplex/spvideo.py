@@ -97,6 +97,7 @@ class SageVideo(BaseVideo):
         # super(SageVideo, self).__init__()
 
         # initialize additional defaults
+        self.id = mf.get('MediaFileID')
         self.watchedStartTime = 0  # in ms
         self.watchedEndTime = 0    # in ms
         self.realWatchedStartTime = 0  # in ms
@@ -236,6 +237,7 @@ class PlexVideo(BaseVideo):
 
         # initialize additional defaults
         self.file = ''
+        self.size = None  # file size in bytes, if known
 
         # sanity check
         TAG_TYPE = 'Video'
@@ -277,6 +279,8 @@ class PlexVideo(BaseVideo):
         p = node[0][0]  # Media/Part, this seems more reliable than .find()
         if p.tag == 'Part':
             self.file = os.path.basename(p.get('file'))
+            if p.get('size'):
+                self.size = int(p.get('size'))
             # now set the plex media id
             self.id = node.get('ratingKey')
 
@@ -313,6 +317,13 @@ class PlexVideo(BaseVideo):
             s += ' [not watched]'
         return s
 
+    def getFingerprint(self):
+        '''Return a string that changes whenever the PLEX side of the
+        sync changes: watch status, resume position, or the file.
+        '''
+        return '%s|%s|%s|%s|%s' % (self.resume, self.viewCount,
+                                   self.lastWatched, self.file, self.size)
+
     def getTitle(self):
         '''Return the title, ASCII safe'''
         if self.title:
@@ -0,0 +1,344 @@
+#####################################################################
+#
+# Author:  Raymond Chi
+#
+# Module that keeps the state of sageplex_sync.py between runs in a
+# SQLite database.
+#
+# For each library section, it records a watermark: the newest PLEX
+# lastViewedAt/updatedAt seen by the last complete sync. The next
+# incremental sync only needs to look at videos newer than that.
+#
+# For each video, it records the last reconciled state of both sides
+# (PLEX ratingKey and SageTV MediaFileID, resume position, watched
+# status and times) with a fingerprint of the PLEX side. A video whose
+# fingerprint did not change since it was last found in sync doesn't
+# need a SageTV lookup, and the recorded state can be reported without
+# asking either server.
+#
+# It also keeps named cursors, such as the SageTV time the SageTV
+# change feed was last read up to.
+#
+######################################################################
+
+import time, threading
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+import plexlog  # log wrapper for scanner/agent
+
+# PLEX <Video> attributes [s] tracked by the watermark
+WATERMARK_ATTRS = ('lastViewedAt', 'updatedAt')
+
+# item status values
+ITEM_INSYNC = 'insync'  # both sides agree
+ITEM_PLEX = 'plex'      # PLEX out of sync
+ITEM_SAGE = 'sage'      # SageTV out of sync
+ITEM_NOSAGE = 'nosage'  # not in SageTV
+ITEM_STATUS = (ITEM_INSYNC, ITEM_PLEX, ITEM_SAGE, ITEM_NOSAGE)
+
+# item columns, in table order
+ITEM_COLUMNS = ('ratingKey', 'mediaFileId', 'title', 'fingerprint',
+                'status', 'plexResume', 'plexWatched', 'plexLastWatched',
+                'sageResume', 'sageWatched', 'sageLastWatched', 'verified')
+
+# default max age [s] of an in-sync video before it's checked again
+DEFAULT_REVERIFY = 7 * 24 * 3600
+
+# bump when the tables change, older state files are then emptied
+SCHEMA_VERSION = 1
+
+
+######################################################################
+# SyncState class
+######################################################################
+
+class SyncState(object):
+    '''SQLite backed state of the sync tool'''
+
+    def __init__(self, filename, log=None, reverify=None):
+        '''Creates a SyncState object
+
+        If the database can't be opened (no sqlite3 module, bad path,
+        etc), the object is still created but remembers nothing.
+
+        @param filename  path to the sqlite database file, or None
+        @param log       plexlog obj, or None
+        @param reverify  [s] max age of an in-sync video record before
+                         SageTV is checked again, or None for default
+        '''
+        self.log = log if log else plexlog.PlexLog()
+        self.filename = filename
+        self.reverify = reverify or DEFAULT_REVERIFY
+        self.lock = threading.Lock()
+        self.db = None
+
+        if not filename:
+            self.log.warning('SyncState: no state file, state disabled')
+            return
+        if not sqlite3:
+            self.log.warning('SyncState: sqlite3 not available, state disabled')
+            return
+        try:
+            self.db = sqlite3.connect(filename, timeout=30,
+                                      check_same_thread=False)
+            version = self.db.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                self.db.execute('DROP TABLE IF EXISTS watermark')
+                self.db.execute('DROP TABLE IF EXISTS item')
+                self.db.execute('DROP TABLE IF EXISTS cursor')
+                self.db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+            self.db.execute('CREATE TABLE IF NOT EXISTS watermark ('
+                            ' section TEXT PRIMARY KEY,'
+                            ' lastViewedAt INTEGER NOT NULL,'
+                            ' updatedAt INTEGER NOT NULL,'
+                            ' synced REAL NOT NULL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS item ('
+                            ' ratingKey TEXT PRIMARY KEY,'
+                            ' mediaFileId INTEGER,'
+                            ' title TEXT,'
+                            ' fingerprint TEXT NOT NULL,'
+                            ' status TEXT NOT NULL,'
+                            ' plexResume INTEGER,'
+                            ' plexWatched INTEGER,'
+                            ' plexLastWatched INTEGER,'
+                            ' sageResume INTEGER,'
+                            ' sageWatched INTEGER,'
+                            ' sageLastWatched INTEGER,'
+                            ' verified REAL NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS item_status'
+                            ' ON item (status)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS item_mediafile'
+                            ' ON item (mediaFileId)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS cursor ('
+                            ' name TEXT PRIMARY KEY,'
+                            ' value INTEGER NOT NULL)')
+            self.db.commit()
+            self.log.debug('SyncState: %s', filename)
+        except sqlite3.Error, e:
+            self.log.error('SyncState: failed to open %s: %s', filename, e)
+            self.db = None
+
+    def getWatermark(self, section):
+        '''Return the watermark of a library section
+
+        @param section  PLEX library section id
+        @return         dict of WATERMARK_ATTRS -> time [s], without
+                        the ones never seen. None if the section was
+                        never synced
+        '''
+        if not self.db:
+            return
+        try:
+            with self.lock:
+                row = self.db.execute('SELECT lastViewedAt, updatedAt'
+                                      ' FROM watermark WHERE section = ?',
+                                      (str(section),)).fetchone()
+        except sqlite3.Error, e:
+            self.log.error('SyncState.getWatermark: %s', e)
+            return
+        if row:
+            return dict([(k, v) for (k, v) in zip(WATERMARK_ATTRS, row) if v])
+
+    def setWatermark(self, section, mark):
+        '''Record the watermark of a completely synced section
+
+        @param section  PLEX library section id
+        @param mark     dict of WATERMARK_ATTRS -> time [s]
+        '''
+        if not self.db:
+            return
+        try:
+            with self.lock:
+                self.db.execute('INSERT OR REPLACE INTO watermark'
+                                ' (section, lastViewedAt, updatedAt, synced)'
+                                ' VALUES (?, ?, ?, ?)',
+                                (str(section), mark.get('lastViewedAt', 0),
+                                 mark.get('updatedAt', 0), time.time()))
+                self.db.commit()
+        except sqlite3.Error, e:
+            self.log.error('SyncState.setWatermark: %s', e)
+
+    def getItem(self, ratingKey):
+        '''Return the recorded state of a video
+
+        @param ratingKey  PLEX ratingKey (media-id) of the video
+        @return           dict of ITEM_COLUMNS, or None if not recorded
+        '''
+        if not self.db:
+            return
+        try:
+            with self.lock:
+                row = self.db.execute('SELECT %s FROM item WHERE ratingKey = ?'
+                                      % ', '.join(ITEM_COLUMNS),
+                                      (str(ratingKey),)).fetchone()
+        except sqlite3.Error, e:
+            self.log.error('SyncState.getItem: %s', e)
+            return
+        if row:
+            return dict(zip(ITEM_COLUMNS, row))
+
+    def getRatingKeys(self, mediaFileId):
+        '''Return the PLEX videos recorded for a SageTV media file
+
+        @param mediaFileId  SageTV MediaFileID
+        @return             list of PLEX ratingKeys, usually one
+        '''
+        if not self.db or mediaFileId is None:
+            return []
+        try:
+            with self.lock:
+                rows = self.db.execute('SELECT ratingKey FROM item'
+                                       ' WHERE mediaFileId = ?',
+                                       (mediaFileId,)).fetchall()
+        except sqlite3.Error, e:
+            self.log.error('SyncState.getRatingKeys: %s', e)
+            return []
+        return [r[0] for r in rows]
+
+    def isInSync(self, pv, sv=None):
+        '''Whether a video is known to be in sync without asking SageTV
+
+        True if it was found in sync less than reverify seconds ago,
+        and its PLEX side did not change since. Changes made in SageTV
+        are only seen if its current SageTV state is passed in,
+        otherwise the caller has to look for those itself.
+
+        @param pv  PlexVideo object
+        @param sv  SageVideo object to compare with the recorded
+                   SageTV state, or None to trust the record
+        @return    True if the SageTV lookup can be skipped
+        '''
+        item = self.getItem(pv.id)
+        if not (item and item['status'] == ITEM_INSYNC and
+                item['fingerprint'] == pv.getFingerprint() and
+                time.time() - item['verified'] < self.reverify):
+            return False
+        return sv is None or (item['mediaFileId'] == sv.id and
+                              item['sageResume'] == sv.resume and
+                              item['sageWatched'] == int(sv.getWatched()) and
+                              item['sageLastWatched'] == sv.lastWatched)
+
+    def putItem(self, pv, sv, status):
+        '''Record the state of a video after it was checked
+
+        Changes are committed with the next watermark, commit() or
+        close(), so recording each video doesn't cost a disk sync.
+
+        @param pv      PlexVideo object
+        @param sv      SageVideo object, or None if not in SageTV
+        @param status  one of ITEM_STATUS
+        '''
+        if not self.db:
+            return
+        row = (str(pv.id), sv.id if sv else None, pv.title, pv.getFingerprint(), status,
+               pv.resume, int(pv.getWatched()), pv.lastWatched,
+               sv.resume if sv else None,
+               int(sv.getWatched()) if sv else None,
+               sv.lastWatched if sv else None,
+               time.time())
+        try:
+            with self.lock:
+                self.db.execute('INSERT OR REPLACE INTO item (%s) VALUES (%s)'
+                                % (', '.join(ITEM_COLUMNS),
+                                   ', '.join('?' * len(ITEM_COLUMNS))), row)
+        except sqlite3.Error, e:
+            self.log.error('SyncState.putItem: %s', e)
+
+    def listItems(self, status=None):
+        '''Return the recorded videos, without asking PLEX or SageTV
+
+        @param status  only return videos with this ITEM_STATUS, or
+                       None for all
+        @return        list of dict of ITEM_COLUMNS, ordered by title
+        '''
+        if not self.db:
+            return []
+        sql = 'SELECT %s FROM item' % ', '.join(ITEM_COLUMNS)
+        params = ()
+        if status:
+            sql += ' WHERE status = ?'
+            params = (status,)
+        try:
+            with self.lock:
+                rows = self.db.execute(sql + ' ORDER BY title', params).fetchall()
+        except sqlite3.Error, e:
+            self.log.error('SyncState.listItems: %s', e)
+            return []
+        return [dict(zip(ITEM_COLUMNS, r)) for r in rows]
+
+    def countItems(self):
+        '''Return the number of recorded videos per ITEM_STATUS
+
+        @return  dict of status -> count
+        '''
+        if not self.db:
+            return {}
+        try:
+            with self.lock:
+                rows = self.db.execute('SELECT status, COUNT(*) FROM item'
+                                       ' GROUP BY status').fetchall()
+        except sqlite3.Error, e:
+            self.log.error('SyncState.countItems: %s', e)
+            return {}
+        return dict(rows)
+
+    def getCursor(self, name):
+        '''Return a named cursor
+
+        @param name  cursor name
+        @return      value, or None if never set
+        '''
+        if not self.db:
+            return
+        try:
+            with self.lock:
+                row = self.db.execute('SELECT value FROM cursor WHERE name = ?',
+                                      (name,)).fetchone()
+        except sqlite3.Error, e:
+            self.log.error('SyncState.getCursor: %s', e)
+            return
+        if row:
+            return row[0]
+
+    def setCursor(self, name, value):
+        '''Set a named cursor, committed right away
+
+        @param name   cursor name
+        @param value  integer value
+        '''
+        if not self.db:
+            return
+        try:
+            with self.lock:
+                self.db.execute('INSERT OR REPLACE INTO cursor (name, value)'
+                                ' VALUES (?, ?)', (name, value))
+                self.db.commit()
+        except sqlite3.Error, e:
+            self.log.error('SyncState.setCursor: %s', e)
+
+    def commit(self):
+        '''Write the recorded changes to disk'''
+        if not self.db:
+            return
+        try:
+            with self.lock:
+                self.db.commit()
+        except sqlite3.Error, e:
+            self.log.error('SyncState.commit: %s', e)
+
+    def close(self):
+        '''Close the state database, saving any recorded changes'''
+        if self.db:
+            self.commit()
+            with self.lock:
+                self.db.close()
+                self.db = None
+
+
+# useful stuff
+# python falsy values: None/False/0/''/{}
+# function implicit return: None
@@ -0,0 +1,113 @@
+#####################################################################
+#
+# Author:  Raymond Chi
+#
+# Module that implements a small fixed size pool of worker threads.
+# Work under both scanner (standalone python) and agent (PMS framework)
+#
+# python 2 has no concurrent.futures, so this provides the little we
+# need of it: submit() a function to the pool, and later wait for its
+# result() from the submitting thread.
+#
+######################################################################
+
+import sys, threading, Queue
+
+# max time [s] to block at once while waiting for a result, so the
+# waiting thread still gets to run signal handlers (ctrl-c)
+WAIT_SLICE = 1.0
+
+
+######################################################################
+# Future class
+######################################################################
+
+class Future(object):
+    '''Result of a function submitted to a WorkerPool'''
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.value = None
+        self.error = None  # sys.exc_info() if func raised
+        self.done = threading.Event()
+
+    def run(self):
+        '''Call the function and store its result, in a worker'''
+        try:
+            self.value = self.func(*self.args, **self.kwargs)
+        except Exception:
+            self.error = sys.exc_info()
+        self.done.set()
+
+    def result(self):
+        '''Wait for the function to finish and return its result
+
+        @return  return value of the function
+        @raise   the exception raised by the function, if any
+        '''
+        while not self.done.wait(WAIT_SLICE):
+            pass
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
+
+
+######################################################################
+# WorkerPool class
+######################################################################
+
+class WorkerPool(object):
+    '''Fixed number of threads running submitted functions in order
+
+    At most size functions run at the same time, the rest wait in the
+    queue. Functions should not wait on other Futures of the same
+    pool, or the pool can deadlock.
+    '''
+
+    def __init__(self, size, name='worker'):
+        '''Creates a WorkerPool object and starts its threads
+
+        @param size  number of worker threads
+        @param name  thread name prefix, for debugging
+        '''
+        self.size = size
+        self.queue = Queue.Queue()
+        self.threads = []
+        for i in range(size):
+            t = threading.Thread(target=self.work, name='%s-%d' % (name, i))
+            t.daemon = True  # don't hold up exit on ctrl-c
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, func, *args, **kwargs):
+        '''Queue a function call to run on a worker thread
+
+        @param func  function to call with args/kwargs
+        @return      Future of the call
+        '''
+        future = Future(func, args, kwargs)
+        self.queue.put(future)
+        return future
+
+    def work(self):
+        '''Worker thread main loop'''
+        while True:
+            future = self.queue.get()
+            if future is None:  # close() was called
+                return
+            future.run()
+
+    def close(self):
+        '''Stop the worker threads once the queued calls are done'''
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+
+# useful stuff
+# python falsy values: None/False/0/''/{}
+# function implicit return: None
@@ -19,7 +19,7 @@
 # Reference:
 #   https://github.com/plexinc-plugins/Scanners.bundle/blob/master/Contents/Resources/Movies/Plex%20Movie%20Scanner.py
 
-import re, os, os.path, sys, logging
+import re, os, os.path, sys, logging, atexit
 import Media, VideoFiles, Stack, Utils
 
 LOG_FORMAT = '%(asctime)s| %(levelname)-8s| %(message)s'
@@ -33,6 +33,8 @@ LOG_FORMAT = '%(asctime)s| %(levelname)-8s| %(message)s'
 import sageplex.plexlog # log wrapper for scanner/agent
 import sageplex.config  # handles sageplex configuration file
 import sageplex.sagex   # handles sagex API to SageTV
+import sageplex.mfcache # persistent MediaFile cache
+import sageplex.spscan  # scanning core shared with the other scanner
 
 logging.basicConfig(format=LOG_FORMAT, level=logging.DEBUG)  # use console
 sageplexcfg = sageplex.config.Config(sys.platform)  # create Config object
@@ -45,6 +47,32 @@ mylog.updateLoggingConfig(sageplexcfg.getScannerLog(), LOG_FORMAT,
 
 mylog.debug('Python ' + sys.version)
 
+# SageTV client shared by all Scan() calls of this scanner process, PMS
+# calls Scan() for every directory so keep-alive connections, the index
+# and the MediaFile cache then carry over from one directory to the next.
+#
+# the MediaFile cache lets rescans of unchanged files skip SageTV, it
+# commits every entry so only needs closing when the process exits
+mfcache = None
+if sageplexcfg.getCacheFile():
+    mfcache = sageplex.mfcache.MediaFileCache(sageplexcfg.getCacheFile(),
+                                              sageplexcfg.getCacheTtl(),
+                                              sageplexcfg.getCacheMaxEntries())
+    atexit.register(mfcache.close)
+
+sageapi = sageplex.sagex.SageX(sageplexcfg.getSagexHost(),
+                               poolSize=sageplexcfg.getSagexPoolSize(),
+                               poolTimeout=sageplexcfg.getSagexPoolTimeout(),
+                               useIndex=sageplexcfg.getSagexIndex(),
+                               indexTtl=sageplexcfg.getSagexIndexTtl(),
+                               cache=mfcache,
+                               profile=sageplex.sagex.PROFILE_SCANNER
+                               if sageplexcfg.getSagexProfiles() else None)
+
+# start loading the index while PMS walks to the first directory
+if sageplexcfg.getScannerWarmUp():
+    sageapi.warmUp()
+
 ####################
 
 
@@ -64,10 +92,6 @@ def Scan(path, files, mediaList, subdirs):
     mylog.info('***** Entering SageTV Movie Scanner.Scan *****')
     mylog.debug('Path: ' + (path if path else 'ROOT'))
 
-    # create sagex obj for SageTV API call
-    sagexHost = sageplexcfg.getSagexHost()
-    sageapi = sageplex.sagex.SageX(sagexHost)
-    
     # scans the current dir and return the list files for processing.
     # files that have already been processed will not be returned.
     mylog.debug('Calling VideoFiles.Scan() ...');
@@ -77,11 +101,28 @@ def Scan(path, files, mediaList, subdirs):
         mylog.info('')  # done write empty line so we have good separator for next time
         return
 
+    # classify all the files of the directory at once, from their
+    # .properties sidecars if enabled, reusing what either scanner
+    # cached for unchanged files, and looking up the rest in SageTV
+    # with one request instead of one per file
+    mylog.debug('Getting media info from SageTV ...')
+    items = sageplex.spscan.getScanItems(sageapi, files,
+                                         sageplexcfg.getScannerExt(), mylog,
+                                         sidecars=sageplexcfg.getScannerSidecar())
+
     # stat we track while in loop
     stat = { 'item': 0,
              'size': len(files),
              'added': 0}
 
+    # mediaList objects by movie key, so more segments of a recording
+    # are added to its object without searching mediaList. the objects
+    # that got more segments are sorted once at the end
+    mItems = {}
+    mGrouped = {}  # id -> mediaList object
+    for mItem in mediaList:
+        mItems.setdefault((mItem.name, mItem.year), mItem)
+
     # interate over all files found in VideoFiles.Scan above
     for i in files:
         # i contains the full path to the file
@@ -96,36 +137,23 @@ def Scan(path, files, mediaList, subdirs):
             mylog.info('wrong extension, skipping: %s', fext)
             continue
 
-        # Get SageTV media info from sagex via HTTP call
-        mylog.debug('Getting media info from SageTV ...')
-        mf = sageapi.getMediaFileForName(filename)
-        if not mf:
+        # SageTV media info, classified and parsed from sagex or from
+        # the cache if the file hasn't changed since it was looked up
+        item = items.get(filename)
+        if not item:
             # this would happen if there is a file on the Plex import
             # directory but that file is not yet in Sage's DB
             mylog.error("No media info from SageTV: %s", filename)
             continue
 
-        # retrieving the airing/show field that should always exist
-        airing = mf.get('Airing')
-        if not airing:
-            mylog.error('no Airing field, skipping file');
-            continue
-        showMF = airing.get('Show')
-        if not showMF:
-            mylog.error('no [Airing][Show] field, skipping file');
+        # check to see if movie or not
+        if item['kind'] != sageplex.spscan.KIND_MOVIE:
+            mylog.warning('Not a movie (%s), skipping', item['kind'])
             continue
 
-        # check to see if TV show or not
-        if not isRecordedMovie(mf, airing, showMF):
-            continue
-
-        showTitle = showMF.get('ShowTitle').encode('UTF-8')
-        mylog.debug('ShowTitle: %s', showTitle)
-
-        showYear = showMF.get('ShowYear').encode('UTF-8')
-        mylog.debug('ShowYear: %s', showYear)
-        if not showYear:
-            showYear = ''
+        showTitle = item['title']
+        showYear = item['year']
+        mylog.debug('Movie: %s (%s)', showTitle, showYear)
 
         # now we create the Media.Movie object representing this
         # movie so we can add it to PLEX.
@@ -134,30 +162,24 @@ def Scan(path, files, mediaList, subdirs):
 
         # need to handle mutliple recordings for the
         # same physical show i.e. -0.mpg, -1.mpg, -2.mpg
-        m_seg = mf.get('NumberOfSegments')
+        m_seg = item['segments']
         if (m_seg > 1):
             # if show have more than one segment, see if we need to
             # add this to an existing mediaFile object
             mylog.info("Media has more than 1 segment: %s", m_seg)
-            # first lookup the show in the current added mediaList, if
+            # first lookup the movie in the current added mediaList, if
             # found, this means we've processed existing segments of
-            # the show, so just add the additional segments
-            mFound = False
-            for mItem in mediaList:
-                # is this the right show
-                if (mItem.name != showTitle or mItem.year != showYear):
-                    continue
-                # found the show, add file to show
-                mItem.parts.append(i)  # add to end
-                mItem.parts.sort()     # sort file list lexically
+            # the movie, so just add the additional segments
+            mItem = mItems.get((showTitle, showYear))
+            if mItem is not None:
+                # found the movie, add file to it. parts are sorted
+                # once all files are added
+                mItem.parts.append(i)
+                mGrouped[id(mItem)] = mItem
                 mylog.info('Added to existing mediaList obj: %s', mItem)
-                # handled, so break out of search loop
                 stat['added'] += 1
-                mFound = True
-                break
-            if mFound:
                 # multi-segment and used an existing mediaList object,
-                # so done, go to next file. the current tv_show object
+                # so done, go to next file. the current movie object
                 # is discarded.
                 continue
 
@@ -166,9 +188,13 @@ def Scan(path, files, mediaList, subdirs):
         movie.parts.append(i)
         mylog.info("Adding movie to mediaList")
         mediaList.append(movie)
+        mItems.setdefault((showTitle, showYear), movie)
         stat['added'] += 1
 
     # END "for i in files"
+    for mItem in mGrouped.values():
+        mItem.parts.sort()  # sort file list lexically
+    sageapi.logStats()
     mylog.info('Total: %d of %d added to mediaList',
                stat['added'], stat['size'])
 
@@ -179,49 +205,7 @@ def Scan(path, files, mediaList, subdirs):
 
     mylog.info('')  # done write empty line so we have good separator for next time
 
-def isRecordedMovie(mf, airing, show):
-    '''Is this a recorded movie that we should process
 
-    @param mf      MediaFile obj from sage
-    @param airing  mf['Airing']
-    @param show    airing['Show']
-    @return        True/False
-    '''
-    # check if this is a sage recording or not
-    if not mf.get('IsTVFile'):
-        mylog.warning("File is NOT TV recording! skipping")
-        return False
-
-
-    #  Check if MediaFileMetadataProperties/MediaType is Movie
-    mediaFileMetadataProperties = mf.get("MediaFileMetadataProperties")
-    if mediaFileMetadataProperties:
-	mylog.debug("found a MediaFileMetadataProperties.  Looking for MediaType")
-        mediaType = mediaFileMetadataProperties.get("MediaType")
-        if mediaType:
-	    if 'Movie' in mediaType:
-		mylog.debug("MediaType says Movie, processing")
-		return True
-	    else:
-		mylog.debug("MediaType is %s, continuing checks...", mediaType)
-	else:
-	    mylog.debug("MediaType not Found....")
-    else:
-	mylog.debug("MediaFileMetadataProperties not Found....")
-
-    # now check category
-    category = show.get('ShowCategoriesList')
-    if not category:
-        mylog.warning("No ShowCategoriesList! skipping")
-        return False
-
-    if not ('Movie' in category):
-        mylog.warning("Show is NOT a movie, skipping: %s", category)
-        return False
-
-    return True;
-
-    
 # useful stuff
 # python falsy values: None/False/0/''/{}
 # function implicit return: None
@@ -18,7 +18,7 @@
 # Reference:
 #   https://github.com/plexinc-plugins/Scanners.bundle/blob/master/Contents/Resources/Series/Plex%20Series%20Scanner.py
 
-import re, os, os.path, sys, logging, datetime
+import re, os, os.path, sys, logging, atexit
 import Media, VideoFiles, Stack, Utils
 
 LOG_FORMAT = '%(asctime)s| %(levelname)-8s| %(message)s'
@@ -32,6 +32,8 @@ LOG_FORMAT = '%(asctime)s| %(levelname)-8s| %(message)s'
 import sageplex.plexlog # log wrapper for scanner/agent
 import sageplex.config  # handles sageplex configuration file
 import sageplex.sagex   # handles sagex API to SageTV
+import sageplex.mfcache # persistent MediaFile cache
+import sageplex.spscan  # scanning core shared with the other scanner
 
 logging.basicConfig(format=LOG_FORMAT, level=logging.DEBUG)  # use console
 sageplexcfg = sageplex.config.Config(sys.platform)  # create Config object
@@ -44,6 +46,32 @@ mylog.updateLoggingConfig(sageplexcfg.getScannerLog(), LOG_FORMAT,
 
 mylog.debug('Python ' + sys.version)
 
+# SageTV client shared by all Scan() calls of this scanner process, PMS
+# calls Scan() for every directory so keep-alive connections, the index
+# and the MediaFile cache then carry over from one directory to the next.
+#
+# the MediaFile cache lets rescans of unchanged files skip SageTV, it
+# commits every entry so only needs closing when the process exits
+mfcache = None
+if sageplexcfg.getCacheFile():
+    mfcache = sageplex.mfcache.MediaFileCache(sageplexcfg.getCacheFile(),
+                                              sageplexcfg.getCacheTtl(),
+                                              sageplexcfg.getCacheMaxEntries())
+    atexit.register(mfcache.close)
+
+sageapi = sageplex.sagex.SageX(sageplexcfg.getSagexHost(),
+                               poolSize=sageplexcfg.getSagexPoolSize(),
+                               poolTimeout=sageplexcfg.getSagexPoolTimeout(),
+                               useIndex=sageplexcfg.getSagexIndex(),
+                               indexTtl=sageplexcfg.getSagexIndexTtl(),
+                               cache=mfcache,
+                               profile=sageplex.sagex.PROFILE_SCANNER
+                               if sageplexcfg.getSagexProfiles() else None)
+
+# start loading the index while PMS walks to the first directory
+if sageplexcfg.getScannerWarmUp():
+    sageapi.warmUp()
+
 ####################
 
 # --------------------
@@ -72,10 +100,6 @@ def Scan(path, files, mediaList, subdirs):
     mylog.info('***** Entering SageTV Scanner.Scan *****')
     mylog.debug('Path: ' + (path if path else 'ROOT'))
 
-    # create sagex obj for SageTV API call
-    sagexHost = sageplexcfg.getSagexHost()
-    sageapi = sageplex.sagex.SageX(sagexHost)
-
     # scans the current dir and return the list files for processing.
     # files that have already been processed will not be returned.
     mylog.debug('Calling VideoFiles.Scan() ...');
@@ -85,11 +109,29 @@ def Scan(path, files, mediaList, subdirs):
         mylog.info('')  # done write empty line so we have good separator for next time
         return
 
+    # classify all the files of the directory at once, from their
+    # .properties sidecars if enabled, reusing what either scanner
+    # cached for unchanged files, and looking up the rest in SageTV
+    # with one request instead of one per file
+    mylog.debug('Getting media info from SageTV ...')
+    items = sageplex.spscan.getScanItems(sageapi, files,
+                                         sageplexcfg.getScannerExt(), mylog,
+                                         sidecars=sageplexcfg.getScannerSidecar())
+
     # stat we track while in loop
     stat = { 'item': 0,
              'size': len(files),
              'added': 0}
 
+    # mediaList objects by show key, so more segments of a recording
+    # are added to its object without searching mediaList. the objects
+    # that got more segments are sorted once at the end
+    mItems = {}
+    mGrouped = {}  # id -> mediaList object
+    for mItem in mediaList:
+        mItems.setdefault((mItem.show, mItem.season, mItem.episode,
+                           mItem.name), mItem)
+
     # interate over all files found in VideoFiles.Scan above
     for i in files:
         # i contains the full path to the file
@@ -104,114 +146,26 @@ def Scan(path, files, mediaList, subdirs):
             mylog.info('wrong extension, skipping: %s', fext)
             continue
 
-        # Get SageTV media info from sagex via HTTP call
-        mylog.debug('Getting media info from SageTV ...')
-        mf = sageapi.getMediaFileForName(filename)
-        if not mf:
+        # SageTV media info, classified and parsed from sagex or from
+        # the cache if the file hasn't changed since it was looked up
+        item = items.get(filename)
+        if not item:
             # this would happen if there is a file on the Plex import
             # directory but that file is not yet in Sage's DB
             mylog.error("No media info from SageTV: %s", filename)
             continue
 
-        # retrieving the airing/show field that should always exist
-        airing = mf.get('Airing')
-        if not airing:
-            mylog.error('no Airing field, skipping file');
-            continue
-        showMF = airing.get('Show')
-        if not showMF:
-            mylog.error('no [Airing][Show] field, skipping file');
-            continue
-
         # check to see if TV show or not
-        if not isRecordedTv(mf, airing, showMF):
+        if item['kind'] != sageplex.spscan.KIND_TV:
+            mylog.warning('Not a TV show (%s), skipping', item['kind'])
             continue
 
-        showTitle = showMF.get('ShowTitle').encode('UTF-8')
-        mylog.debug('ShowTitle: %s', showTitle)
-
-        episodeTitle = showMF.get('ShowEpisode').encode('UTF-8')
-        mylog.debug('ShowEpisode: %s', episodeTitle)
-
-        if not episodeTitle:
-            mylog.warning('Using Title as Episode')
-            episodeTitle = showTitle
-
-        # Try and get show year, if show year is blank,
-        # then try using original airdate, if
-        # originalairdate is blank use recordeddate year
-        showYear = showMF.get('ShowYear').encode('UTF-8')
-        mylog.debug('ShowYear: %s', showYear)
-
-        # always try to get the airDate as we need it later
-        airDate = None
-        startTime = float(showMF.get('OriginalAiringDate') // 1000)
-        recordTime = float(airing.get('AiringStartTime') // 1000)
-        if (startTime > 0):
-            airDate = datetime.date.fromtimestamp(startTime)
-        elif (recordTime > 0):
-            airDate = datetime.date.fromtimestamp(recordTime)
-        else:
-            airDate = datetime.datetime.now()
-            mylog.warning('No OriginalAiringDate/AiringStartTime! '
-                          'Using today as airDate: %s', airDate)
-
-        if not showYear:
-            mylog.warning('Setting show year from airDate: %s', airDate)
-            showYear = int(airDate.year)
-        else:
-            showYear = int(showYear)
-
-        # must convert to int or else Plex throws a
-        # serialization exception
-        s_num = int(showMF.get('ShowSeasonNumber'))
-        mylog.debug('ShowSeasonNumber: %d', s_num)
-
-        # must convert to string or else Plex throws a
-        # serialization exception
-        ep_num = int(showMF.get('ShowEpisodeNumber'))
-        mylog.debug('ShowEpisodeNumber: %d', ep_num)
-
-        # if there is no season or episode number, default
-        # it to 0 so that Plex can still pull it in
-        if not ep_num:
-            # AiringIDs are strictly internal to Wiz.bin and vary from
-            # one Sage installation to another. So lets not use it.
-            # ep_num = int(airing.get('AiringID'))
-
-            # first try last 4 digit of ShowExternalID. This is what
-            # sage uses in its UI and represent zip2it's episode-id.
-            mylog.warning('No episode number, trying to set a suitable one ...')
-            programId = showMF.get('ShowExternalID')
-            if programId:
-		mylog.debug('programId: %s', programId)
-                # http://forums.schedulesdirect.org/viewtopic.php?f=8&t=41
-                # MV+10-12 digits for movies
-                # SP+10-12 digits for sports
-                # EP+SERIESID+EPISODEID for a series where episode info is known
-                # SH+SERIESID+0000 for a series where episode info is *not* known.
-                #    SERIESID could be 6 or 8 chars
-                ep_num = programId[-4:] # last 4 chars
-
-		#  Handle this little aberration: EPtvdbs00e00
-		if ep_num.isdigit():
-                    ep_num = str(int(ep_num))
-	        else:
-                    ep_num = 0
-
-                if ep_num == '0':  # all 0, can't use
-                    mylog.warning('ShowExternalID[-4:] is all zero: %s', programId)
-                    ep_num = None
-                else:
-                    mylog.warning('Setting ep_num to ShowExternalID[-4:]: %s', ep_num)
-            # next we try airing date
-            if not ep_num:
-                ep_num = airDate.strftime('%Y%m%d')
-                mylog.warning('Setting ep_num to airDate: %s', ep_num)
-
-        if not s_num:
-            s_num = showYear
-            mylog.warning("Show number is 0, setting to show year: %d", s_num)
+        showTitle = item['title']
+        episodeTitle = item['episodeTitle']
+        s_num = item['season']
+        ep_num = item['episode']
+        mylog.debug('Show: %s, S%sE%s: %s', showTitle, s_num, ep_num,
+                    episodeTitle)
 
         # now we create the Media.Episode object representing this
         # show so we can add it to PLEX.
@@ -223,7 +177,7 @@ def Scan(path, files, mediaList, subdirs):
 
         # need to handle mutliple recordings for the
         # same physical show i.e. -0.mpg, -1.mpg, -2.mpg
-        m_seg = mf.get('NumberOfSegments')
+        m_seg = item['segments']
         if (m_seg > 1):
             # if show have more than one segment, see if we need to
             # add this to an existing mediaFile object
@@ -231,21 +185,14 @@ def Scan(path, files, mediaList, subdirs):
             # first lookup the show in the current added mediaList, if
             # found, this means we've processed existing segments of
             # the show, so just add the additional segments
-            mFound = False
-            for mItem in mediaList:
-                # is this the right show
-                if (mItem.show != showTitle or mItem.season != s_num or
-                    mItem.episode != ep_num or mItem.name != episodeTitle):
-                    continue
-                # found the show, add file to show
-                mItem.parts.append(i)  # add to end
-                mItem.parts.sort()     # sort file list lexically
+            mItem = mItems.get((showTitle, s_num, ep_num, episodeTitle))
+            if mItem is not None:
+                # found the show, add file to it. parts are sorted
+                # once all files are added
+                mItem.parts.append(i)
+                mGrouped[id(mItem)] = mItem
                 mylog.info('Added to existing mediaList obj: %s', mItem)
-                # handled, so break out of search loop
                 stat['added'] += 1
-                mFound = True
-                break
-            if mFound:
                 # multi-segment and used an existing mediaList object,
                 # so done, go to next file. the current tv_show object
                 # is discarded.
@@ -257,9 +204,13 @@ def Scan(path, files, mediaList, subdirs):
 
         mylog.info("Adding show to mediaList")
         mediaList.append(tv_show)
+        mItems.setdefault((showTitle, s_num, ep_num, episodeTitle), tv_show)
         stat['added'] += 1
 
     # END "for i in files"
+    for mItem in mGrouped.values():
+        mItem.parts.sort()  # sort file list lexically
+    sageapi.logStats()
     mylog.info('Total: %d of %d added to mediaList',
                stat['added'], stat['size'])
 
@@ -270,47 +221,6 @@ def Scan(path, files, mediaList, subdirs):
 
     mylog.info('')  # done write empty line so we have good separator for next time
 
-def isRecordedTv(mf, airing, show):
-    '''Is this a recorded TV program that we should process
-
-    @param mf      MediaFile obj from sage
-    @param airing  mf['Airing']
-    @param show    airing['Show']
-    @return        True/False
-    '''
-    # check if this is a sage recording or not
-    if not mf.get('IsTVFile'):
-        mylog.warning("File is NOT TV recording! skipping")
-        return False
-    
-    #  Check MediaType
-    mediaFileMetadataProperties = mf.get("MediaFileMetadataProperties")
-    if mediaFileMetadataProperties:
-	mylog.debug("Found a MediaFileMetadataProperties.  Getting MediaType")
-        mediaType = mediaFileMetadataProperties.get("MediaType")
-	if mediaType:
-	    if 'Movie' in mediaType:
-		mylog.debug("MediaType says Movie, skipping")
-		return False
-	    else:
-		mylog.debug("MediaType is %s, continuing checks...", mediaType)
-	else:
-	    mylog.debug("MediaType not Found....")
-    else:
-	mylog.debug("MediaFileMetadataProperties not Found....")
-
-    # now check category
-    category = show.get('ShowCategoriesList')
-    if not category:
-        mylog.warning("No ShowCategoriesList! skipping")
-        return False
-
-    if 'Movie' in category:
-        mylog.warning("Show is a movie, skipping: %s", category)
-        return False
-
-    return True;
-
 
 if __name__ == '__main__':
     import sys
@@ -27,16 +27,26 @@
 
 import os
 import sys
+import time
+import datetime
 import logging
 import argparse
 import signal
 import pprint
+import threading
+import collections
+import Queue
+import socket
+import SocketServer
 
 import sageplex.plexlog  # log wrapper for scanner/agent
 import sageplex.config   # read configuration files
 import sageplex.sagex    # SageTV API calls
+import sageplex.mfcache  # persistent MediaFile cache
 import sageplex.plexapi  # PLEX API calls
 import sageplex.spvideo  # parsing sage/plex video obj
+import sageplex.syncstate  # state kept between syncs
+import sageplex.workpool   # worker threads for --jobs
 
 PROG_DESC = ('Compare or synchronize watch status and resume position '
              'of the specified PLEX library sections with SageTV. '
@@ -46,14 +56,29 @@ PROG_USAGE = 'sageplex_sync.py [options] [id [id ...]]'
 
 LOG_FORMAT = '%(asctime)s| %(levelname)-8s| %(message)s'
 
+# --daemon defaults, see sync section of sageplex_cfg.json
+DEFAULT_INTERVAL = 300       # [s] between scheduled syncs
+DEFAULT_FAST_INTERVAL = 30   # [s] between syncs after changes were seen
+DEFAULT_CONTROL_PORT = 8099  # localhost port of the control interface
+
+# sync state cursor of the SageTV change feed
+SAGE_CURSOR = 'sage_changes'
+
 mycfg = None
 mylog = None
 sageapi = None
 plexapi = None
+syncstate = None
+sagestates = None  # SageTV watch status snapshot, filename -> MediaFile
 
 g_args = None
 g_exit = False  # signal script to gracefully exit
 g_stat = None
+g_pool = None   # WorkerPool for --jobs, or None
+g_jobs = collections.deque()  # VideoJobs not reported yet, in order
+g_local = threading.local()   # .job: VideoJob run by this thread
+g_recheck = set()  # ratingKeys changed in SageTV, to check anyway
+g_checked = set()  # ratingKeys checked by this sync
 
 
 ######################################################################
@@ -85,6 +110,8 @@ class Stat:
         self.processed = 0  # number of videos processed
         self.updated = 0    # number of videos updated
         self.insync = 0     # number of videos in sync
+        self.unchanged = 0  # in sync videos skipped, per sync state
+        self.failed = 0     # videos whose check raised an error
         self.plex = []      # plex videos out of sync
         self.sage = []      # sage videos out of sync
         self.nosage = []    # videos not in sagetv
@@ -94,6 +121,8 @@ class Stat:
         s = '%d videos' % self.processed
         if self.insync:
             s += ', %d in-sync' % self.insync
+        if self.unchanged:
+            s += ' (%d unchanged)' % self.unchanged
         if self.plex:
             s += ', %d PLEX out-of-sync' % len(self.plex)
         if self.sage:
@@ -102,8 +131,24 @@ class Stat:
             s += ', %d not in SageTV' % len(self.nosage)
         if self.updated:
             s += ', %d updated' % self.updated
+        if self.failed:
+            s += ', %d failed' % self.failed
         return s
 
+    def merge(self, other):
+        """add the statistics of another Stat object
+
+        @param other  Stat object
+        """
+        self.processed += other.processed
+        self.updated += other.updated
+        self.insync += other.insync
+        self.unchanged += other.unchanged
+        self.failed += other.failed
+        self.plex.extend(other.plex)
+        self.sage.extend(other.sage)
+        self.nosage.extend(other.nosage)
+
     def addPlex(self, m_id, title, p_resume, s_resume, p_watch, s_watch):
         """add an out of sync plex title to list
 
@@ -167,6 +212,134 @@ class Stat:
         print '\nTotal: %s.' % g_stat
 
 
+######################################################################
+# concurrent sync (--jobs)
+######################################################################
+
+class JobOutput(object):
+    """sys.stdout replacement that holds the output of VideoJobs
+
+    Output written by a thread running a VideoJob is kept in the job
+    until it is reported, so the console shows the videos in order
+    whatever order the workers finish in. Other output, and output of
+    a job whose turn it is, goes to the real stdout.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def buffer(self):
+        job = getattr(g_local, 'job', None)
+        if job and not job.direct:
+            return job.output
+
+    def write(self, s):
+        buf = self.buffer()
+        if buf is not None:
+            buf.append(s)
+        else:
+            self.stream.write(s)
+
+    def flush(self):
+        if self.buffer() is None:
+            self.stream.flush()
+
+    # print's softspace must be kept per thread, or videos printed by
+    # different workers would mess up each other's spacing
+    def getSoftspace(self):
+        return getattr(g_local, 'softspace', 0)
+
+    def setSoftspace(self, value):
+        g_local.softspace = value
+
+    softspace = property(getSoftspace, setSoftspace)
+
+
+class VideoJob(object):
+    """A video checked/synced by a worker thread
+
+    Its console output and statistics are kept until reportJobs()
+    gets to it. A job that needs to prompt the user (-p) waits in
+    waitTurn() until all the videos before it are reported.
+    """
+
+    def __init__(self, node, log):
+        self.node = node
+        self.log = log
+        self.stat = Stat()
+        self.output = []                # console output held back
+        self.direct = False             # output goes to stdout
+        self.turn = threading.Event()   # set when its turn to report
+        self.future = None
+        self.dropped = False            # set by dropJobs()
+
+    def run(self):
+        """check the video, in a worker thread"""
+        g_local.job = self
+        g_local.softspace = 0
+        try:
+            if not (g_exit or self.dropped):
+                checkVideo(self.node, self.log, self.stat)
+        finally:
+            g_local.job = None
+
+    def waitTurn(self):
+        """wait until all videos before this one are reported, then
+        write directly to the console"""
+        while not self.turn.wait(sageplex.workpool.WAIT_SLICE):
+            pass
+        sys.stdout.stream.write(''.join(self.output))
+        self.output = []
+        self.direct = True
+
+
+def waitTurn():
+    """if running a VideoJob, wait until its turn to use the console"""
+    job = getattr(g_local, 'job', None)
+    if job:
+        job.waitTurn()
+
+
+def reportJobs(maxPending=0):
+    """Report finished VideoJobs in order
+
+    Waits for the oldest jobs until at most maxPending are left, and
+    writes their output and adds their statistics to g_stat.
+
+    @param maxPending  number of jobs that may be left unreported
+    """
+    while len(g_jobs) > maxPending:
+        job = g_jobs.popleft()
+        job.turn.set()
+        try:
+            job.future.result()
+        except Exception, e:
+            # one video failing doesn't stop the others
+            mylog.error('failed to check video %s: %s',
+                        job.node.get('ratingKey'), e)
+            job.output.append('[failed: %s]\n' % e)
+            job.stat.failed += 1
+        sys.stdout.stream.write(''.join(job.output))
+        sys.stdout.stream.flush()
+        g_stat.merge(job.stat)
+        # check if we need to exit (ctrl-c)
+        if g_exit:
+            mylog.error('Got SIGINT, exiting!!')
+            sys.exit(1)
+
+
+def dropJobs():
+    """Drop the VideoJobs not reported yet, when a sync stops early
+
+    Jobs not started yet are skipped by the workers, and jobs waiting
+    for their turn to prompt are let go.
+    """
+    while g_jobs:
+        job = g_jobs.popleft()
+        job.dropped = True
+        job.turn.set()
+
+
 ######################################################################
 # list PLEX library sections
 ######################################################################
@@ -209,6 +382,7 @@ def syncMediaId(args):
         else:
             print 'Displaying media-id %s: %s' % (x, path)
         plexapi.walkPlex(path, None, processVideo)
+        reportJobs()
 
 
 def syncSections(args):
@@ -218,7 +392,6 @@ def syncSections(args):
     """
     sections = None
     slist = []
-    path = '/library/sections'
 
     # if all is specified, get all sections and add to work list
     if 'all' in args.id:
@@ -254,16 +427,134 @@ def syncSections(args):
     else:
         print 'Sections to display: %s' % slist
 
+    # a full sync compares every video, so get the SageTV watch
+    # status of all media files in one go instead of asking per video
+    global sagestates
+    sagestates = None  # a daemon must not reuse the last sync's
+    if not args.incremental:
+        print 'Loading SageTV watch status ...',
+        sys.stdout.flush()
+        sagestates = sageapi.getWatchStates()
+        if sagestates is None:
+            print '[failed, checking videos one by one]'
+        else:
+            print '[%d files]' % len(sagestates)
+
+    # the PLEX watermarks don't see changes made in SageTV
+    if args.incremental:
+        syncSageChanges(args)
+
     for s in slist:
-        path = ('/library/sections/%s/all' % s)
+        syncSection(s, args)
+
+
+def syncSageChanges(args):
+    """Sync the videos changed in SageTV since the last incremental sync
+
+    The SageTV change feed gives the media files changed since the
+    cursor saved by the last sync, and the sync state maps them to
+    the PLEX videos they were synced with. Those are checked first,
+    so the section scans that follow can skip them as unchanged.
+    Videos never synced before are left to the section scans.
+
+    The cursor is shared by all sections, so changed videos are
+    checked whatever section they are in.
+
+    @param args  namespace from ArgumentParser.parse_args
+    """
+    since = syncstate.getCursor(SAGE_CURSOR)
+    feed = sageapi.changeFeed(since)
+    keys = []
+    try:
+        for mf in feed:
+            for k in syncstate.getRatingKeys(mf.get('MediaFileID')):
+                if k not in keys:
+                    keys.append(k)
+    except IOError, e:
+        print 'Failed to get SageTV changes: %s' % str(e)
+        return
+
+    if since is None:
+        print 'Following SageTV changes from now on'
+    elif not feed.complete:
+        print ('SageTV only knows some of the changes since the last sync, '
+               'run a full sync to be sure')
+    if keys:
+        print 'Syncing %d videos changed in SageTV' % len(keys)
+    for k in keys:
+        g_recheck.add(k)
+        plexapi.walkPlex('/library/metadata/%s' % k, None, processVideo)
+    reportJobs()
+    g_recheck.clear()  # checked now, the scans can skip them
+    syncstate.commit()
+
+    # only a real sync brings the videos up to date
+    if args.sync and not args.simulate:
+        syncstate.setCursor(SAGE_CURSOR, feed.since)
+
+
+def syncSection(s, args):
+    """Sync/info a section, or only its videos changed since last sync
+
+    The newest lastViewedAt/updatedAt of the videos processed is
+    recorded as the section's watermark once it is synced, so the
+    next incremental (-i) sync can skip older videos.
+
+    @param s     PLEX library section id
+    @param args  namespace from ArgumentParser.parse_args
+    """
+    mark = None
+    if args.incremental:
+        mark = syncstate.getWatermark(s)
+        if not mark:
+            print 'No previous sync of section %s, syncing all' % s
+    newMark = dict(mark or {})
+
+    def leafCb(node, log):
+        # track the watermark, then process as usual
+        for attr in sageplex.syncstate.WATERMARK_ATTRS:
+            t = int(node.get(attr) or 0)
+            if t > newMark.get(attr, 0):
+                newMark[attr] = t
+        processVideo(node, log)
+
+    done = False
+    if mark:
+        print 'Syncing section %s changes since: %s' % (
+            s, time.ctime(min(mark.values())))
+        try:
+            for e1 in plexapi.iterChangedVideos(s, mark):
+                leafCb(e1, mylog)
+            done = True
+        except IOError, e:
+            print 'Failed to list changes of section %s: %s' % (s, str(e))
+    if not done:
+        path = ('/library/sections/%s/allLeaves' % s)
         print 'Syncing section %s: %s' % (s, path)
-        plexapi.walkPlex(path, None, processVideo)
+        done = plexapi.walkSection(s, leafCb)
+        if not done:
+            # allLeaves failed, walk the section tree instead. the walk
+            # doesn't say whether it saw everything, so the watermark
+            # is left alone
+            path = ('/library/sections/%s/all' % s)
+            print 'Walking section %s: %s' % (s, path)
+            plexapi.walkPlex(path, None, leafCb)
+    reportJobs()
+
+    # only a real sync of the whole section brings it up to date. a
+    # watermark from a partial listing would skip the videos missed
+    if args.sync and not args.simulate and newMark and done:
+        syncstate.setWatermark(s, newMark)
+    syncstate.commit()
 
 
 def processVideo(node, log):
     """Process the video node and synchronize the resume position and
     watched status.
 
+    With --jobs, the video is queued to the worker pool instead and
+    reported later, in order, by reportJobs().
+
     @param node   xml <Video> node
     @param log    the log object
     """
@@ -271,7 +562,28 @@ def processVideo(node, log):
     if g_exit:
         mylog.error('Got SIGINT, exiting!!')
         sys.exit(1)
-    g_stat.processed += 1
+    # a video changed in SageTV is also listed by its section scan
+    key = node.get('ratingKey')
+    if key in g_checked:
+        return
+    g_checked.add(key)
+    if g_pool:
+        job = VideoJob(node, log)
+        job.future = g_pool.submit(job.run)
+        g_jobs.append(job)
+        reportJobs(g_pool.size * 2)  # bound the lookahead
+    else:
+        checkVideo(node, log, g_stat)
+
+
+def checkVideo(node, log, stat):
+    """Compare a video with SageTV, and sync it if asked to
+
+    @param node   xml <Video> node
+    @param log    the log object
+    @param stat   Stat object to update
+    """
+    stat.processed += 1
 
     # first get the PlexVideo info from XML data
     pv = sageplex.spvideo.PlexVideo(node, log)
@@ -296,19 +608,32 @@ def processVideo(node, log):
         if not g_args.simulate:
             # Plex seems to ignore starting pos under a minute
             plexapi.setProgress(pv.id, g_args.positionSec)
-            g_stat.updated += 1
+            stat.updated += 1
             print '[done]'
         else:
             print '[simulate]'
         return
 
+    # skip the SageTV lookup if the video was found in sync and PLEX
+    # did not change since, unless asked to check everything. the sync
+    # state only fingerprints the PLEX side, so with a watch status
+    # snapshot the SageTV side must match the recorded state too, and
+    # files missing from the snapshot are looked up.
+    if (not (g_args.reverify or g_args.media or pv.id in g_recheck) and
+            isUnchanged(pv, log)):
+        stat.insync += 1
+        stat.unchanged += 1
+        print '[OK, unchanged]'
+        return
+
     # get SagetV information for video file
-    mf = sageapi.getMediaFileForName(pv.file)
+    mf = getSageMediaFile(pv)
     # mf = sample_mf()
     if not mf:
         print '[not in Sage]'
         log.info('file not in SageTV: %s', pv.file)
-        g_stat.addNoSage(pv.id, pv.getTitle(), pv.getResumeStr(), pv.getWatched())
+        stat.addNoSage(pv.id, pv.getTitle(), pv.getResumeStr(), pv.getWatched())
+        syncstate.putItem(pv, None, sageplex.syncstate.ITEM_NOSAGE)
         return
     sv = sageplex.spvideo.SageVideo(mf, log)
     sn_resume = sv.getResumeNorm()
@@ -348,7 +673,8 @@ def processVideo(node, log):
 
     # 3. if both watched/position are in sync, we are done
     if watched_sync and pos_sync:
-        g_stat.insync += 1
+        stat.insync += 1
+        syncstate.putItem(pv, sv, sageplex.syncstate.ITEM_INSYNC)
         print reason
         if g_args.media:
             # print detailed timing info
@@ -367,24 +693,55 @@ def processVideo(node, log):
     if not pos_sync:
         if sv.lastWatched < pv.lastWatched:
             # sync sage pos with PLEX data
-            updateSage(sv, pv, airing, syncPos=True)
+            updateSage(sv, pv, airing, stat, syncPos=True)
         else:
             # sync plex pos with Sage data
-            updatePlex(pv, sv, syncPos=True)
+            updatePlex(pv, sv, stat, syncPos=True)
     elif not watched_sync:
         if sv.getWatched():  # Sage true PLEX must be false
             assert not pv.getWatched()
-            updatePlex(pv, sv, syncStatus=True)
+            updatePlex(pv, sv, stat, syncStatus=True)
         elif pv.getWatched():  # PLEX true sage must be false
             assert not sv.getWatched()
-            updateSage(sv, pv, airing, syncStatus=True)
+            updateSage(sv, pv, airing, stat, syncStatus=True)
         else:
             assert False
     else:
         assert False
 
 
-def updatePlex(pv, sv, syncStatus=False, syncPos=False):
+def isUnchanged(pv, log):
+    """Whether a video is still in sync as recorded by the sync state
+
+    @param pv   PlexVideo object
+    @param log  the log object
+    @return     True if the video can be skipped
+    """
+    if not sagestates:
+        return syncstate.isInSync(pv)
+    mf = sagestates.get(pv.file.encode('utf-8'))
+    return bool(mf and
+                syncstate.isInSync(pv, sageplex.spvideo.SageVideo(mf, log)))
+
+
+def getSageMediaFile(pv):
+    """Return the SageTV MediaFile of a PLEX video
+
+    Looked up in the watch status snapshot if one was loaded. Files
+    not in it (eg, not a TV file, or recorded since) are looked up
+    with SageTV directly.
+
+    @param pv  PlexVideo object
+    @return    json[MediaFile] or None
+    """
+    if sagestates:
+        mf = sagestates.get(pv.file.encode('utf-8'))
+        if mf:
+            return mf
+    return sageapi.getMediaFileForName(pv.file, pv.size)
+
+
+def updatePlex(pv, sv, stat, syncStatus=False, syncPos=False):
     """Update PLEX metadata from Sage
 
     @param pv          PlexVideo object
@@ -395,9 +752,11 @@ def updatePlex(pv, sv, syncStatus=False, syncPos=False):
     if not syncStatus and not syncPos:
         return
 
-    g_stat.addPlex(pv.id, pv.title,
+    stat.addPlex(pv.id, pv.title,
                    pv.getResumeStr(None), sv.getResumeStr(None),
                    pv.getWatched(), sv.getWatched())
+    # an update changes the PLEX fingerprint, so it's checked again
+    syncstate.putItem(pv, sv, sageplex.syncstate.ITEM_PLEX)
     print '[PLEX out of sync]'
     print '\t  PLEX: %s' % pv.getInfo()
     print '\t  Sage: %s' % sv.getInfo(g_args.media)  # detail if individual media
@@ -425,13 +784,13 @@ def updatePlex(pv, sv, syncStatus=False, syncPos=False):
 
     # output done message
     if not g_args.simulate:
-        g_stat.updated += 1
+        stat.updated += 1
         print '[done]'
     else:
         print '[simulate]'
 
 
-def updateSage(sv, pv, airing, syncStatus=False, syncPos=False):
+def updateSage(sv, pv, airing, stat, syncStatus=False, syncPos=False):
     """Update Sage metadata from PLEX
 
     @param sv          SageVideo object
@@ -443,9 +802,12 @@ def updateSage(sv, pv, airing, syncStatus=False, syncPos=False):
     if not syncStatus and not syncPos:
         return
 
-    g_stat.addSage(pv.id, pv.title,
+    stat.addSage(pv.id, pv.title,
                    sv.getResumeStr(None), pv.getResumeStr(None),
                    sv.getWatched(), pv.getWatched())
+    # not recorded as in sync even if updated, so the next run
+    # verifies the update once
+    syncstate.putItem(pv, sv, sageplex.syncstate.ITEM_SAGE)
     print '[Sage out of sync]'
     print '\t  Sage: %s' % sv.getInfo(g_args.media)  # detail if individual media
     print '\t  PLEX: %s' % pv.getInfo()
@@ -490,7 +852,7 @@ def updateSage(sv, pv, airing, syncStatus=False, syncPos=False):
 
     # output done message
     if not g_args.simulate:
-        g_stat.updated += 1
+        stat.updated += 1
         print '[done]'
     else:
         print '[simulate]'
@@ -510,6 +872,7 @@ def askUser(msg, prompt, default='n', silentDefault='y', silent=False):
     prompt += ' (y/n [%s]) ' % default
 
     if not silent:
+        waitTurn()  # a job only prompts once the videos before it are done
         if msg:
             print msg
         answer = raw_input(prompt).strip()
@@ -542,14 +905,263 @@ def mainSync(args):
         if not askUser(msg, 'Are you sure you want to continue?'):
             return
 
+    g_checked.clear()
+
+    # check videos on a worker pool, holding back their output until
+    # the videos before them are reported
+    global g_pool
+    if args.jobs > 1:
+        g_pool = sageplex.workpool.WorkerPool(args.jobs, name='sync')
+        sys.stdout = JobOutput(sys.stdout)
+
     # are we syncing individual media
-    if args.media:
-        syncMediaId(args)
-    else:
-        syncSections(args)
+    try:
+        if args.media:
+            syncMediaId(args)
+        else:
+            syncSections(args)
+    finally:
+        if g_pool:
+            sys.stdout = sys.stdout.stream
+            # only left if the sync stopped early
+            dropJobs()
+            g_pool.close()
+            g_pool = None
 
     # done print summary
     g_stat.printSummary()
+    sageapi.logStats()
+    plexapi.logStats()
+
+
+######################################################################
+# daemon mode
+######################################################################
+
+class ControlHandler(SocketServer.StreamRequestHandler):
+    """A connection to the daemon control port
+
+    Commands, one per line, each answered with one line:
+        sync ID [ID ...]    sync PLEX library sections (id/name/all)
+        media ID [ID ...]   sync PLEX media-ids
+        status              result of the last sync
+        quit                close the connection
+    """
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline(1024)
+            if not line:
+                return
+            words = line.split()
+            if not words:
+                continue
+            cmd = words[0].lower()
+            if cmd in ('sync', 'media') and len(words) > 1:
+                if cmd == 'media' and not all(x.isdigit() for x in words[1:]):
+                    self.reply('ERROR media-id must be a number')
+                    continue
+                self.server.requests.put((cmd, words[1:]))
+                mylog.info('control: queued %s', words)
+                self.reply('OK queued')
+            elif cmd == 'status':
+                self.reply('OK %s' % self.server.status)
+            elif cmd == 'quit':
+                return
+            else:
+                self.reply('ERROR unknown command: %s' % line.strip())
+
+    def reply(self, msg):
+        self.wfile.write(msg + '\n')
+
+
+class ControlServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """Local control interface of the daemon, queues sync requests"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port, requests):
+        """Creates a ControlServer and starts serving in a thread
+
+        @param port      TCP port to listen on, localhost only
+        @param requests  Queue.Queue to put (command, ids) requests on
+        """
+        SocketServer.TCPServer.__init__(self, ('127.0.0.1', port),
+                                        ControlHandler)
+        self.requests = requests
+        self.status = 'no sync yet'
+        t = threading.Thread(target=self.serve_forever, name='control')
+        t.daemon = True
+        t.start()
+
+
+def daemonSync(args, cmd, ids):
+    """Run one sync in daemon mode
+
+    @param args  namespace from ArgumentParser.parse_args
+    @param cmd   'sync' for sections, 'media' for media-ids
+    @param ids   list of section id/names or media-ids
+    @return      Stat object of the sync, or None if it failed
+    """
+    global g_stat, g_args, g_pool
+    # mainSync() cleans up after a failed sync, but make sure nothing
+    # of an earlier one is left to mix into this one
+    dropJobs()
+    if g_pool:
+        g_pool.close()
+        g_pool = None
+    runArgs = argparse.Namespace(**vars(args))
+    runArgs.id = ids
+    runArgs.media = cmd == 'media'
+    runArgs.incremental = not runArgs.media
+    g_stat = Stat()
+    print '\n***** %s: %s %s *****' % (time.ctime(), cmd, ' '.join(ids))
+    mylog.info('daemon: %s %s', cmd, ids)
+    g_args = runArgs  # processVideo() checks the global args
+    try:
+        mainSync(runArgs)
+    except Exception, e:
+        # keep the daemon going, the next sync may work again
+        mylog.error('daemon: %s %s failed: %s', cmd, ids, e)
+        print 'Sync failed: %s' % e
+        return
+    finally:
+        g_args = args
+    return g_stat
+
+
+def mainDaemon(args):
+    """Keep syncing the sections until stopped with ctrl-c
+
+    Syncs are incremental, and run every sync.interval seconds, or
+    every sync.fast_interval seconds after one that found changes.
+    More syncs can be requested on the control port, see
+    ControlHandler. The SageX/PlexApi objects and the sync state are
+    kept between syncs.
+
+    @param args  namespace from ArgumentParser.parse_args
+    """
+    interval = mycfg.getSyncInterval() or DEFAULT_INTERVAL
+    fastInterval = mycfg.getSyncFastInterval() or DEFAULT_FAST_INTERVAL
+    port = mycfg.getSyncControlPort()
+    if port is None:
+        port = DEFAULT_CONTROL_PORT
+
+    requests = Queue.Queue()
+    server = None
+    if port:
+        try:
+            server = ControlServer(port, requests)
+        except socket.error, e:
+            print 'Failed to open control port %s: %s' % (port, e)
+            return
+        print 'Control port: localhost:%s' % port
+    print 'Syncing %s every %ss (%ss after changes), ctrl-c to stop' % (
+        ' '.join(args.id), interval, fastInterval)
+
+    nextRun = 0  # first sync right away
+    while not g_exit:
+        # wait for the next scheduled sync or a request, waking up
+        # now and then to check for ctrl-c
+        req = None
+        wait = nextRun - time.time()
+        if wait > 0:
+            try:
+                req = requests.get(True, min(wait, sageplex.workpool.WAIT_SLICE))
+            except Queue.Empty:
+                continue
+        if req:
+            cmd, ids = req
+        else:
+            cmd, ids = 'sync', args.id
+
+        stat = daemonSync(args, cmd, ids)
+        # someone is watching, check again soon
+        changed = stat and (stat.updated or stat.plex or stat.sage)
+        if not req:
+            nextRun = time.time() + interval
+        if changed:
+            nextRun = min(nextRun, time.time() + fastInterval)
+        if server:
+            server.status = '%s: %s %s: %s' % (
+                time.ctime(), cmd, ' '.join(ids), stat or 'failed')
+        print 'Next sync: %s' % time.ctime(nextRun)
+
+    if server:
+        server.shutdown()
+        server.server_close()
+
+
+def mainTrigger(args):
+    """Ask a running --daemon to sync sections or media-ids now
+
+    @param args  namespace from ArgumentParser.parse_args
+    """
+    port = mycfg.getSyncControlPort()
+    if port is None:
+        port = DEFAULT_CONTROL_PORT
+    if not port:
+        print 'Control port is disabled in the configuration!'
+        return
+    cmd = 'media' if args.media else 'sync'
+    try:
+        conn = socket.create_connection(('127.0.0.1', port), 10)
+        try:
+            conn.sendall('%s %s\nstatus\nquit\n' % (cmd, ' '.join(args.id)))
+            f = conn.makefile('r')
+            print f.readline().strip()
+            print 'Last sync: %s' % f.readline().strip()
+        finally:
+            conn.close()
+    except socket.error, e:
+        print 'Failed to contact the sync daemon on port %s: %s' % (port, e)
+
+
+######################################################################
+# report recorded sync status
+######################################################################
+
+def mainReport(args):
+    """Report the sync status recorded in the sync state database
+
+    Nothing is sent to PLEX or SageTV, so this shows the status as of
+    the last time each video was checked.
+
+    @param args  namespace from ArgumentParser.parse_args
+    """
+    counts = syncstate.countItems()
+    if not counts:
+        print 'No sync status recorded in: %s' % syncstate.filename
+        return
+
+    def resumeStr(resume, watched):
+        s = str(datetime.timedelta(seconds=(resume or 0) // 1000))
+        return '%s [%s]' % (s, watchedToStr(watched))
+
+    for status, title in ((sageplex.syncstate.ITEM_PLEX, 'PLEX out of sync'),
+                          (sageplex.syncstate.ITEM_SAGE, 'SageTV out of sync'),
+                          (sageplex.syncstate.ITEM_NOSAGE, 'Not in SageTV')):
+        items = syncstate.listItems(status)
+        if not items:
+            continue
+        print '\n%s:' % title
+        for x in items:
+            s = '[%s] %s (PLEX %s' % (
+                x['ratingKey'], (x['title'] or '').encode('ascii', 'replace'),
+                resumeStr(x['plexResume'], x['plexWatched']))
+            if x['mediaFileId']:
+                s += ' vs SageTV %s' % resumeStr(x['sageResume'], x['sageWatched'])
+            s += ', checked %s)' % time.ctime(x['verified'])
+            print '\t' + s
+
+    print '\nTotal: %d videos, %d in-sync, %d PLEX out-of-sync, ' \
+        '%d SageTV out-of-sync, %d not in SageTV.' % (
+            sum(counts.values()),
+            counts.get(sageplex.syncstate.ITEM_INSYNC, 0),
+            counts.get(sageplex.syncstate.ITEM_PLEX, 0),
+            counts.get(sageplex.syncstate.ITEM_SAGE, 0),
+            counts.get(sageplex.syncstate.ITEM_NOSAGE, 0))
 
 
 ######################################################################
@@ -646,6 +1258,18 @@ def parseArgs():
     group.add_argument('-s', '--sync',
                        help='sync watch status',
                        action='store_true')
+    group.add_argument('--daemon',
+                       help='keep running and sync the sections '
+                       'incrementally on a schedule',
+                       action='store_true')
+    group.add_argument('--trigger',
+                       help='ask a running --daemon to sync the sections '
+                       '(or media-ids with -m) now',
+                       action='store_true')
+    group.add_argument('--report',
+                       help='report sync status recorded by previous runs, '
+                       'without contacting PLEX or SageTV',
+                       action='store_true')
     # rest of parameters
     parser.add_argument('-m', '--media',
                         help='ID is media-id, not section-id',
@@ -665,6 +1289,22 @@ def parseArgs():
     parser.add_argument('-n', dest='simulate',
                         help='do nothing, simulate sync operation',
                         action='store_true')
+    parser.add_argument('-i', '--incremental',
+                        help='only check videos changed in PLEX since the '
+                        'last sync of the section, and the ones the SageTV '
+                        'change feed reports',
+                        action='store_true')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of videos to check/sync at the same time',
+                        default=1)
+    parser.add_argument('--reverify',
+                        help='check all videos with SageTV, even the ones '
+                        'unchanged since found in sync. Without the SageTV '
+                        'watch status snapshot (-i, or an older plex.js), '
+                        'a change made only in SageTV that the change feed '
+                        'misses is otherwise only seen once sync.reverify '
+                        '(default 7 days) has passed',
+                        action='store_true')
     # stuff for adding a library
     group.add_argument('--addtv', metavar=('NAME', 'PATH'), nargs='+',
                        help='add PLEX library for Sage TV shows',
@@ -725,6 +1365,25 @@ def parseArgs():
         print 'Error: must specify at least one path with --addmovie option!'
         return
 
+    if args.daemon:
+        # daemon syncs whole sections, unattended
+        if not args.id or args.media or args.prompt or args.position:
+            print 'Error: daemon mode needs section IDs, and can\'t use -m, -p or --position!'
+            return
+        args.sync = True
+
+    if args.trigger and not args.id:
+        print 'Error: must specify the sections or media-ids to sync!'
+        return
+
+    if args.jobs < 1:
+        print 'Error: number of jobs (-j) must be at least 1!'
+        return
+
+    if args.incremental and args.media:
+        print 'Error: incremental sync (-i) only works on sections, not Media-ID (-m)!'
+        return
+
     if args.sagedata:
         # must be in media-id mode, not section mode
         if not args.media:
@@ -732,7 +1391,7 @@ def parseArgs():
             return
 
     # any work to do?
-    if (args.list or args.id or
+    if (args.list or args.id or args.report or
             args.addtv or args.addmovie or
             args.delsec or args.refresh):
         return args
@@ -762,7 +1421,7 @@ def setupLogging():
 
 def main():
     """Main entrypoint"""
-    global mycfg, sageapi, plexapi
+    global mycfg, sageapi, plexapi, syncstate
     global g_args, g_stat
 
     # parse arguments
@@ -789,8 +1448,33 @@ def main():
               'Check sageplex_sync.log for additional details.')
         return
 
-    sageapi = sageplex.sagex.SageX(mycfg.getSagexHost())
-    plexapi = sageplex.plexapi.PlexApi(mycfg.getPlexHost(), token=mycfg.getPlexToken())
+    # only fetch the watch status fields, unless we need complete
+    # MediaFiles to dump with --sagedata
+    profile = None
+    if mycfg.getSagexProfiles() and not args.sagedata:
+        profile = sageplex.sagex.PROFILE_SYNC
+    # the sync tool needs current watch status, so it only writes to
+    # the MediaFile cache to keep it warm for the scanner. the sync
+    # profile has the scanner's fields too
+    cache = None
+    if mycfg.getCacheFile():
+        cache = sageplex.mfcache.MediaFileCache(mycfg.getCacheFile(),
+                                                mycfg.getCacheTtl(),
+                                                mycfg.getCacheMaxEntries())
+    sageapi = sageplex.sagex.SageX(mycfg.getSagexHost(),
+                                   poolSize=mycfg.getSagexPoolSize(),
+                                   poolTimeout=mycfg.getSagexPoolTimeout(),
+                                   useIndex=mycfg.getSagexIndex(),
+                                   indexTtl=mycfg.getSagexIndexTtl(),
+                                   cache=cache, cacheRead=False,
+                                   useLock=args.jobs <= 1,
+                                   apiLimit=args.jobs,
+                                   profile=profile)
+    plexapi = sageplex.plexapi.PlexApi(mycfg.getPlexHost(), token=mycfg.getPlexToken(),
+                                       pageSize=mycfg.getPlexPageSize(),
+                                       walkWorkers=mycfg.getPlexWalkWorkers())
+    syncstate = sageplex.syncstate.SyncState(mycfg.getSyncStateFile(),
+                                             reverify=mycfg.getSyncReverify())
 
     # register our ctrol-c handler to gracefully exit.
     mylog.info('registering SIGINT handler ...')
@@ -800,6 +1484,12 @@ def main():
     g_stat = Stat()
     if args.list:
         mainList(args)
+    elif args.report:
+        mainReport(args)
+    elif args.daemon:
+        mainDaemon(args)
+    elif args.trigger:
+        mainTrigger(args)
     elif args.addtv or args.addmovie:
         mainAdd(args)
     elif args.delsec:
@@ -809,6 +1499,7 @@ def main():
     else:
         mainSync(args)
         mylog.info('')  # done, write empty line so we have good separator for next time
+    syncstate.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,169 @@
+# testing the sync tool without a PLEX or SageTV server
+#
+# Run with
+#   python test_sageplex_sync.py
+# Fake PLEX/SageTV objects are plugged into the sync tool's globals
+#
+import sys, os, logging, tempfile, shutil, argparse, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'common'))
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+from sageplex import plexapi, syncstate
+import sageplex_sync
+
+
+class FakePlexApi(plexapi.PlexApi):
+    '''PlexApi serving allLeaves from memory, failing after failPage pages'''
+
+    def __init__(self, videos, pageSize=2, failPage=None, error=IOError):
+        plexapi.PlexApi.__init__(self, 'http://127.0.0.1:1', pageSize=pageSize)
+        self.videos = videos
+        self.failPage = failPage
+        self.error = error
+
+    def iterVideos(self, path, pageSize=None):
+        for start in range(0, len(self.videos), self.pageSize):
+            if start // self.pageSize == self.failPage:
+                raise self.error('injected failure of page %d' % self.failPage)
+            for v in self.videos[start:start + self.pageSize]:
+                yield ET.Element('Video', v)
+
+    def openUrl(self, url, xml=False, log=True):
+        return None  # walkPlex() gets nothing either
+
+
+class FakeFeed(list):
+    '''ChangeFeed without changes'''
+    complete = True
+    since = 1
+
+
+class FakeSageX(object):
+    '''SageX with no watch status snapshot or changes'''
+
+    def getWatchStates(self):
+        return None
+
+    def changeFeed(self, since):
+        return FakeFeed()
+
+    def logStats(self, minInterval=0):
+        pass
+
+
+def makeVideos(n):
+    return [{'ratingKey': str(i), 'updatedAt': str(1000 + i),
+             'lastViewedAt': str(2000 + i)} for i in range(n)]
+
+def syncSection(api):
+    '''Run syncSection() of section 1, return (videos seen, watermark)'''
+    tmp = tempfile.mkdtemp()
+    processVideo = sageplex_sync.processVideo
+    try:
+        seen = []
+        sageplex_sync.plexapi = api
+        sageplex_sync.syncstate = syncstate.SyncState(
+            os.path.join(tmp, 'state.db'))
+        sageplex_sync.processVideo = lambda node, log: seen.append(
+            node.get('ratingKey'))
+        args = argparse.Namespace(incremental=False, sync=True,
+                                  simulate=False)
+        sageplex_sync.syncSection('1', args)
+        mark = sageplex_sync.syncstate.getWatermark('1')
+        sageplex_sync.syncstate.close()
+        return (seen, mark)
+    finally:
+        sageplex_sync.processVideo = processVideo
+        shutil.rmtree(tmp)
+
+def checkVideo(node, log, stat):
+    '''Stands in for checkVideo(), video 2 fails'''
+    stat.processed += 1
+    if node.get('ratingKey') == '2':
+        raise IOError('injected failure of video 2')
+    stat.insync += 1
+    print '  %s [OK]' % node.get('ratingKey')
+
+def syncArgs(jobs):
+    return argparse.Namespace(id=['1'], position=None, media=False,
+                              jobs=jobs, incremental=False, sync=True,
+                              simulate=False)
+
+def setUp(tmp, api):
+    sageplex_sync.plexapi = api
+    sageplex_sync.sageapi = FakeSageX()
+    sageplex_sync.syncstate = syncstate.SyncState(
+        os.path.join(tmp, 'state.db'))
+    sageplex_sync.checkVideo = checkVideo
+    sageplex_sync.g_stat = sageplex_sync.Stat()
+
+def testWatermark():
+    videos = makeVideos(5)
+
+    (seen, mark) = syncSection(FakePlexApi(videos))
+    assert len(seen) == 5, seen
+    assert mark and mark['updatedAt'] == 1004, mark
+
+    # page 2 of 3 fails, the videos after it were never listed
+    (seen, mark) = syncSection(FakePlexApi(videos, failPage=1))
+    assert seen == ['0', '1'], seen
+    assert not mark, mark
+    print 'watermark: OK'
+
+def testJobs():
+    tmp = tempfile.mkdtemp()
+    try:
+        setUp(tmp, FakePlexApi(makeVideos(5)))
+        threads = threading.active_count()
+        sageplex_sync.mainSync(syncArgs(2))
+        stat = sageplex_sync.g_stat
+        # the failed video is counted, the others still checked
+        assert (stat.processed, stat.insync, stat.failed) == (5, 4, 1), \
+            str(stat)
+        assert not sageplex_sync.g_jobs, sageplex_sync.g_jobs
+        assert sageplex_sync.g_pool is None
+        assert threading.active_count() == threads, threading.enumerate()
+        print 'jobs: OK'
+    finally:
+        sageplex_sync.syncstate.close()
+        shutil.rmtree(tmp)
+
+def testDaemon():
+    tmp = tempfile.mkdtemp()
+    try:
+        setUp(tmp, FakePlexApi(makeVideos(8), failPage=2,
+                               error=RuntimeError))
+        threads = threading.active_count()
+        args = syncArgs(2)
+        sageplex_sync.g_args = args
+        # fails part way, with videos still queued
+        assert sageplex_sync.daemonSync(args, 'sync', ['1']) is None
+        assert not sageplex_sync.g_jobs, sageplex_sync.g_jobs
+        assert sageplex_sync.g_pool is None
+
+        # the next trigger only reports its own videos
+        sageplex_sync.plexapi = FakePlexApi(makeVideos(2))
+        stat = sageplex_sync.daemonSync(args, 'sync', ['1'])
+        assert stat and (stat.processed, stat.insync) == (2, 2), str(stat)
+        assert threading.active_count() == threads, threading.enumerate()
+        print 'daemon: OK'
+    finally:
+        sageplex_sync.syncstate.close()
+        shutil.rmtree(tmp)
+
+def main():
+    logging.basicConfig(format='%(asctime)s| %(levelname)-8s| %(message)s',
+                        level=logging.CRITICAL)
+    sageplex_sync.mylog = sageplex_sync.sageplex.plexlog.PlexLog()
+    testWatermark()
+    testJobs()
+    testDaemon()
+
+if __name__ == '__main__':
+    main()